@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import os, sys
+import argparse
+import json
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+import measurement
+import fitcache
+import fitmodels
+import preprocess
+import rendering
+import synthetic
+import CreateTree
+
+linearizationMethods = ['saturation', 'firstpoints', 'saturation2part', 'piecewiseSaturation']
+
+class Benchmark:
+    # times named stages and records the peak resident memory after each of them
+
+    def __init__(self):
+        self.stages = list()
+
+    def Run(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter()-start
+        peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB on linux
+        self.stages.append({ 'stage': name, 'seconds': seconds, 'peakRssMB': peakRss })
+        print(f'{name:>48s}: {seconds:8.3f} s, peak RSS {peakRss:8.1f} MB')
+        return result
+
+def touchDerived(dataTaking):
+    return dataTaking.rate, dataTaking.flux, dataTaking.effectiveGain
+
+def main():
+    ap = argparse.ArgumentParser(add_help=True)
+    ap.add_argument('--points', type=int, default=20, help='xray current setpoints per tree')
+    ap.add_argument('--trees', type=int, default=3)
+    ap.add_argument('--rawSamples', type=int, default=0, help='samples in a synthetic raw log to preprocess, 0 to skip')
+    ap.add_argument('--fitBackends', nargs='+', default=['root', 'scipy'])
+    ap.add_argument('--dividerCurrent', type=float, default=700)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--output', help='json file with the timing of each stage')
+    options = ap.parse_args(sys.argv[1:])
+
+    benchmark = Benchmark()
+    generator = np.random.default_rng(options.seed)
+    distances = np.geomspace(15, 110, options.trees)
+    gainCurve = measurement.GainCurve.FromParameters(-5.2, 0.0235, 0.05, 1e-4)
+
+    with tempfile.TemporaryDirectory() as tmpDirectory:
+        fitcache.cacheDirectory, fitcache.refresh = f'{tmpDirectory}/fits', True # always fit
+
+        treeDfs = benchmark.Run('generate', lambda: [
+            (f'Tree{distance:.0f}cm', synthetic.SaturatingCurve(options.points, distance, generator=generator))
+            for distance in distances
+        ])
+        if options.rawSamples:
+            currentLog = benchmark.Run('generate raw log', synthetic.RawCurrentLog, options.rawSamples, np.linspace(5, 200, options.points), generator=generator)
+            benchmark.Run('preprocess raw log', preprocess.SubtractXrayOff, *currentLog)
+
+        treeFile = f'{tmpDirectory}/RateCapability.root'
+        for method in ['fill', 'columnar']:
+            benchmark.Run(f'CreateTree ({method})', CreateTree.writeTrees, treeFile, treeDfs, method)
+
+        for backend in options.fitBackends:
+            for method in linearizationMethods:
+                meas = benchmark.Run(f'Measurement.FromFile ({backend}, {method})', measurement.Measurement.FromFile, treeFile, gainCurve, options.dividerCurrent, method, backend)
+                for dataTaking in meas:
+                    benchmark.Run(f'{dataTaking.name} linearization ({backend}, {method})', lambda: dataTaking.anodeCurrentLinearized)
+                    benchmark.Run(f'{dataTaking.name} derived quantities ({backend}, {method})', touchDerived, dataTaking)
+        # compilation of the TF1 models, paid by the first root fit of each formula and included in its stage above:
+        for formula,seconds in fitmodels.compileTimes.items(): print(f'{"compile":>48s}: {seconds:8.3f} s, {formula}')
+
+        # plotting, on the last measurement:
+        for dataTaking in meas:
+            path = f'{tmpDirectory}/{dataTaking.name}'
+            for plotName in ['Currents', 'Rate', 'EffectiveGain', 'RateCapability']:
+                save = getattr(dataTaking, f'Save{plotName}')
+                benchmark.Run(f'{dataTaking.name} Save{plotName}', save, f'{path}_{plotName}.eps', f'{path}_{plotName}.root')
+        benchmark.Run('Measurement SaveRateCapability', meas.SaveRateCapability, f'{tmpDirectory}/RateCapability.eps', f'{tmpDirectory}/RateCapability.root')
+
+        renderQueue = rendering.RenderQueue(f'{tmpDirectory}/Batch.root')
+        for dataTaking in meas: dataTaking.QueuePlots(renderQueue, f'{tmpDirectory}/Batch{dataTaking.name}')
+        meas.QueuePlots(renderQueue, f'{tmpDirectory}/BatchRateCapability')
+        benchmark.Run('batch render', renderQueue.Render)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({ 'options': vars(options), 'stages': benchmark.stages, 'compileTimes': fitmodels.compileTimes }, f, indent=2)
+
+if __name__=='__main__': main()
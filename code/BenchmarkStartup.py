@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+import os, sys
+import argparse
+import subprocess
+import time
+
+# each snippet runs in a fresh interpreter, so that import costs are not shared
+snippets = {
+    'import measurement': 'import measurement',
+    'gain (no ROOT)': 'import measurement; gainCurve = measurement.GainCurve({qc5!r}, "scipy"); gainCurve.GetGain({dividerCurrent}); gainCurve.GetError({dividerCurrent})',
+    'gain (ROOT fit)': 'import measurement; gainCurve = measurement.GainCurve({qc5!r}); gainCurve.GetGain({dividerCurrent})',
+    'import ROOT + style': 'import measurement; measurement.rt.TGraph'
+}
+
+def main():
+    ap = argparse.ArgumentParser(add_help=True)
+    ap.add_argument('--qc5', default=os.environ.get('RATE_CAPABILITY_DATA', '.')+'/EffectiveGain.xlsx')
+    ap.add_argument('--dividerCurrent', type=float, default=700)
+    ap.add_argument('--repeat', type=int, default=3)
+    options = ap.parse_args(sys.argv[1:])
+
+    codeDirectory = os.path.dirname(os.path.abspath(__file__))
+    for label,snippet in snippets.items():
+        code = snippet.format(qc5=os.path.abspath(options.qc5), dividerCurrent=options.dividerCurrent)
+        times = list()
+        for irepeat in range(options.repeat):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, '-c', code], cwd=codeDirectory, capture_output=True, text=True)
+            times.append(time.perf_counter()-start)
+            if process.returncode!=0: break
+        if process.returncode!=0: print(f'{label:>24s}: failed, {process.stderr.strip().splitlines()[-1]}')
+        else: print(f'{label:>24s}: {min(times):.3f} s (best of {options.repeat})')
+
+if __name__=='__main__': main()
@@ -3,49 +3,121 @@
 import os, sys
 import argparse
 import re
+import time
+import tempfile
 
 import numpy as np
-import ROOT as rt
 import pandas as pd
 
-import root_style_cms
+from lazyroot import rt
+import excelcache
+import preprocess
+from setpoints import branchName
+import workers
+
+def writeTreeFill(outFile, treeName, treeDf):
+    # original writer: one Fill per row, one python round trip per cell
+    tree = rt.TTree(treeName, 'Current measurement')
+    columnNames = treeDf.columns
+    branchNames = [ branchName(col) for col in columnNames ]
+    branchVariables = dict()
+    for branch in branchNames:
+        branchVariables[branch] = np.zeros(1)
+        tree.Branch(branch, branchVariables[branch], f'{branch}/D')
+
+    print(columnNames, branchNames)
+    for irow,row in treeDf.iterrows():
+        for branch,col in zip(branchNames,columnNames):
+            branchVariables[branch][0] = float(row[col])
+        tree.Fill()
+
+    tree.Print()
+    outFile.Write(treeName)
+
+def writeTreeColumnar(outputFile, treeName, treeDf, update=False):
+    # bulk writer: hand whole float64 columns to RDataFrame and snapshot them in one go
+    columns = { branchName(col): np.ascontiguousarray(treeDf[col], dtype='float64') for col in treeDf.columns }
+    print(list(treeDf.columns), list(columns))
+    try: fromNumpy = rt.RDF.FromNumpy
+    except AttributeError: fromNumpy = rt.RDF.MakeNumpyDataFrame # ROOT < 6.28
+    snapshotOptions = rt.RDF.RSnapshotOptions()
+    snapshotOptions.fMode = 'UPDATE' if update else 'RECREATE'
+    snapshotOptions.fOverwriteIfExists = update # a tree written again replaces the old one
+    fromNumpy(columns).Snapshot(treeName, outputFile, list(columns), snapshotOptions)
+
+def writeTrees(outputFile, treeDfs, method='columnar'):
+    # treeDfs is a list of (tree name, dataframe) pairs
+    if method=='columnar':
+        for itree,(treeName,treeDf) in enumerate(treeDfs):
+            writeTreeColumnar(outputFile, treeName, treeDf, update=itree>0)
+    elif method=='fill':
+        outFile = rt.TFile(outputFile, 'RECREATE')
+        for treeName,treeDf in treeDfs: writeTreeFill(outFile, treeName, treeDf)
+        outFile.Write()
+        outFile.Close()
+    else: raise ValueError('Unrecognized tree writing method')
+
+def readInput(inputFile, raw=False, rawColumns=['Time', 'XrayCurrent', 'Ianode'], settlingTime=0):
+    # parse one input into columnar buffers, a dict column name -> float64 array, cheap to send between processes
+    if raw:
+        currentLog = preprocess.ReadCurrentLog(inputFile, *rawColumns)
+        treeDf = preprocess.SubtractXrayOff(*currentLog, settlingTime=settlingTime)
+    else: treeDf = excelcache.readExcel(inputFile, sheet_name='XRay-off-substracted')
+    return { col: np.ascontiguousarray(treeDf[col], dtype='float64') for col in treeDf.columns }
+
+def initWorker(refresh):
+    excelcache.refresh = refresh
+
+def readInputs(inputFiles, jobs=1, **kwargs):
+    # parse inputs, with jobs>1 in parallel worker processes; buffers are returned in input order
+    if jobs>1:
+        # workers refresh the excel cache if this process does:
+        with workers.spawnPool(jobs, initializer=initWorker, initargs=(excelcache.refresh,)) as executor:
+            futures = [ executor.submit(readInput, inputFile, **kwargs) for inputFile in inputFiles ]
+            return [ future.result() for future in futures ]
+    return [ readInput(inputFile, **kwargs) for inputFile in inputFiles ]
+
+def benchmark(nrows):
+    # time both writers on a synthetic sheet with the same layout as the XRay-off-substracted one
+    columnNames = ['XrayCurrent', 'ERR XrayCurrent', 'Ianode', 'ERR Ianode', 'Idrift', 'ERR Idrift']
+    generator = np.random.default_rng(0)
+    treeDf = pd.DataFrame({ col: generator.random(nrows) for col in columnNames })
+    with tempfile.TemporaryDirectory() as tmpDirectory:
+        for method in ['columnar', 'fill']:
+            start = time.perf_counter()
+            writeTrees(f'{tmpDirectory}/{method}.root', [('TreeBenchmark', treeDf)], method)
+            print(f'{method}: {nrows} rows written in {time.perf_counter()-start:.2f} s')
 
 def main():
     ap = argparse.ArgumentParser(add_help=True)
     ap.add_argument('--input', nargs='+')
     ap.add_argument('--labels', nargs='+', type=str)
     ap.add_argument('--output')
+    ap.add_argument('--method', default='columnar', choices=['columnar', 'fill'])
+    ap.add_argument('--raw', action='store_true', help='inputs are raw current logs, subtract xray-off current and average per setpoint')
+    ap.add_argument('--rawColumns', nargs=3, default=['Time', 'XrayCurrent', 'Ianode'], metavar=('TIME', 'XRAY', 'ANODE'), help='column names in the raw logs')
+    ap.add_argument('--settlingTime', type=float, default=0, help='seconds dropped at the start of each plateau of the raw logs')
+    ap.add_argument('--jobs', type=int, default=1, help='number of processes parsing inputs, trees are written by this one in label order')
+    ap.add_argument('--no-cache', action='store_true', help='parse input workbooks again, refreshing the cache')
+    ap.add_argument('--benchmark', type=int, metavar='ROWS', help='compare tree writers on a synthetic sheet and exit')
     options = ap.parse_args(sys.argv[1:])
 
+    excelcache.refresh = options.no_cache
+
+    if options.benchmark:
+        benchmark(options.benchmark)
+        return
+
     outDirectory = '/'.join(options.output.split('/')[:-1])
     try: os.makedirs(outDirectory)
     except FileExistsError: pass
 
-    outFile = rt.TFile(options.output, 'RECREATE')
-
     # create tree from each input file
-    for label,inputFile in zip(options.labels,options.input):
-        treeDf = pd.read_excel(inputFile, sheet_name='XRay-off-substracted')
-
-        treeName = f'Tree{label}'
-        tree = rt.TTree(treeName, 'Current measurement')
-        columnNames = treeDf.columns
-        branchNames = [ col.replace(' ', '').replace('-', '') for col in columnNames ]
-        branchVariables = dict()
-        for branch in branchNames:
-            branchVariables[branch] = np.zeros(1)
-            tree.Branch(branch, branchVariables[branch], f'{branch}/D')
-
-        print(columnNames, branchNames)
-        for irow,row in treeDf.iterrows():
-            for branch,col in zip(branchNames,columnNames):
-                branchVariables[branch][0] = float(row[col])
-            tree.Fill()
-
-        tree.Print()
-        outFile.Write(treeName)
-
-    outFile.Write()
-    outFile.Close()
-
-if __name__=='__main__': main()
\ No newline at end of file
+    buffers = readInputs(
+        options.input, options.jobs,
+        raw=options.raw, rawColumns=options.rawColumns, settlingTime=options.settlingTime
+    )
+    treeDfs = [ (f'Tree{label}', pd.DataFrame(columns)) for label,columns in zip(options.labels,buffers) ]
+    writeTrees(options.output, treeDfs, options.method)
+
+if __name__=='__main__': main()
@@ -3,24 +3,84 @@
 import os, sys
 import argparse
 import re
+import time
 
 import numpy as np
-import ROOT as rt
 import pandas as pd
 
-import root_style_cms
-
 import measurement
+import excelcache
+import fitcache
+import manifest
+import profiling
+import rendering
+import resultstore
+import scipyfit
+import setpoints
+import toymc
+import CreateTree
+import workers
 
-def main():
-    ap = argparse.ArgumentParser(add_help=True)
-    #ap.add_argument('--input', nargs='+')
-    #ap.add_argument('--output')
-    #ap.add_argument('--qc5')
-    ap.add_argument('--dividerCurrent', type=float)
-    ap.add_argument('--verbose', action='store_true')
-    options = ap.parse_args(sys.argv[1:])
+plotNames = ['AnodeCurrent', 'Rate', 'EffectiveGain', 'RateCapability']
+
+def outputPaths(outputDirectory, treeName, extensions=['eps', 'root']):
+    paths = [ f'{outputDirectory}/{treeName}_{plotName}.{extension}' for plotName in plotNames for extension in extensions ]
+    return paths+[f'{outputDirectory}/{treeName}_Results.npz']
+
+def saveDataTaking(dataTaking, outputDirectory, renderQueue=None):
+    # with a render queue, plots are only queued and drawn later in one pass
+    path = f'{outputDirectory}/{dataTaking.name}'
+    if renderQueue: dataTaking.QueuePlots(renderQueue, path)
+    else:
+        dataTaking.SaveCurrents(f'{path}_AnodeCurrent.eps', f'{path}_AnodeCurrent.root')
+        dataTaking.SaveRate(f'{path}_Rate.eps', f'{path}_Rate.root')
+        dataTaking.SaveEffectiveGain(f'{path}_EffectiveGain.eps', f'{path}_EffectiveGain.root')
+        dataTaking.SaveRateCapability(f'{path}_RateCapability.eps', f'{path}_RateCapability.root')
+    dataTaking.SaveResults(f'{path}_Results.npz')
+
+def processDataTaking(measurementFile, treeName, gainFile, dividerCurrent, linearizationMethod, fitBackend, outputDirectory, noCache=False, chunkSize=None, resolution=setpoints.defaultResolution, render=True, profile=False, breakpoint=scipyfit.defaultBreakpoint, gainErrorColumn=None):
+    # fit and render a single tree in a worker process, return only numpy arrays to the parent
+    excelcache.refresh = fitcache.refresh = noCache
+    fitcache.hits, fitcache.misses = 0, 0 # workers are reused across trees
+    profiling.enabled, profiling.events = profile, list()
+    gainCurve = measurement.GainCurve(gainFile, fitBackend, gainErrorColumn)
+    dataTaking = measurement.DataTaking.FromFile(measurementFile, treeName, gainCurve, dividerCurrent, linearizationMethod, fitBackend, chunkSize, resolution)
+    dataTaking.breakpoint = breakpoint
+    if render: saveDataTaking(dataTaking, outputDirectory)
+    return dataTaking.results, (fitcache.hits, fitcache.misses), profiling.events
+
+def parseDividerCurrents(value):
+    # single value, comma-separated list or inclusive start:stop:step range
+    if ':' in value:
+        start, stop, step = [ float(v) for v in value.split(':') ]
+        return np.arange(start, stop+step/2, step)
+    return np.array([ float(v) for v in value.split(',') ])
 
+def saveScan(scan, path):
+    np.savez(path, **{ f'{treeName}_{quantity}': values for treeName,treeScan in scan.items() for quantity,values in treeScan.items() })
+
+def saveToys(meas, toys, path):
+    # toy mean and standard deviation next to the analytic central value and error of each quantity
+    arrays = dict()
+    for dataTaking in meas:
+        for quantity in ['rate', 'flux', 'effectiveGain']:
+            value, error = getattr(dataTaking, quantity)
+            toyMean, toyError = toys[dataTaking.name][quantity]
+            arrays.update({
+                f'{dataTaking.name}_{quantity}': value, f'{dataTaking.name}_err_{quantity}': error,
+                f'{dataTaking.name}_toyMean_{quantity}': toyMean, f'{dataTaking.name}_toyErr_{quantity}': toyError
+            })
+            print(f'{dataTaking.name} {quantity}: toy/analytic error ratio {np.median(toyError/error):.3f} (median over points)')
+    np.savez(path, **arrays)
+
+def reportProfile(options):
+    if not profiling.enabled: return
+    profiling.Summary()
+    if options.profile:
+        profiling.SaveTrace(options.profile)
+        print('Trace saved to', options.profile)
+
+def analyze(options):
     measurementFile = os.environ['RATE_CAPABILITY_DATA']+'/RateCapability.root'
     gainFile = os.environ['RATE_CAPABILITY_DATA']+'/EffectiveGain.xlsx'
     resultsDirectory = os.environ['RATE_CAPABILITY_RESULTS']+'/RateCapability'
@@ -30,52 +90,202 @@ def main():
         try: os.makedirs(d)
         except FileExistsError: pass
 
-    chamberGainCurve = measurement.GainCurve(gainFile)
-    chamberGain, errChamberGain = chamberGainCurve.GetGain(options.dividerCurrent), chamberGainCurve.GetError(options.dividerCurrent)
-    print(f'{chamberGain} ± {errChamberGain} chamber gain')
+    dividerCurrents = options.dividerCurrent
+    dividerCurrent = dividerCurrents[0]
+    chamberGainCurve = measurement.GainCurve(gainFile, options.fitBackend, options.gainErrorColumn)
+    chamberGain, errChamberGain = chamberGainCurve.GetGainAndError(dividerCurrents)
+    for scanDividerCurrent,scanGain,errScanGain in zip(dividerCurrents,chamberGain,errChamberGain):
+        print(f'{scanGain} ± {errScanGain} chamber gain at {scanDividerCurrent} uA')
 
-    meas = measurement.Measurement.FromFile(measurementFile, chamberGainCurve, options.dividerCurrent, 'piecewiseSaturation')
-    '''for dataTaking in meas:
-        if dataTaking.name=='Tree15cm': dataTaking.linearizationMethod = 'saturation'''
-    
-    for dataTaking in meas: # fit current plots separately for each xray-to-chamber distance
-        path = f'{outputDirectory}/{dataTaking.name}'
-        dataTaking.SaveCurrents(f'{path}_AnodeCurrent.eps', f'{path}_AnodeCurrent.root')
-        dataTaking.SaveRate(f'{path}_Rate.eps', f'{path}_Rate.root')
-        dataTaking.SaveEffectiveGain(f'{path}_EffectiveGain.eps', f'{path}_EffectiveGain.root')
-        dataTaking.SaveRateCapability(f'{path}_RateCapability.eps', f'{path}_RateCapability.root')
-    meas.SaveRateCapability(f'{resultsDirectory}/RateCapability.eps', f'{resultsDirectory}/RateCapability.root')
+    linearizationMethod = 'piecewiseSaturation'
+    store = resultstore.ResultStore(options.store or f'{resultsDirectory}/ResultStore') if options.store or options.run else None
+    if len(dividerCurrents)>1:
+        # divider current scan: fit each tree once and evaluate all derived quantities for all divider currents
+        meas = measurement.Measurement.FromFile(measurementFile, chamberGainCurve, dividerCurrent, linearizationMethod, options.fitBackend, options.chunkSize, options.resolution)
+        meas.SetBreakpoint(options.breakpoint)
+        if options.jointFit: meas.FitJoint()
+        saveScan(meas.Scan(dividerCurrents), f'{resultsDirectory}/DividerCurrentScan.npz')
+        if store: store.Write(resultstore.Table(meas, dividerCurrents), options.run)
+        if options.report_cache: fitcache.report()
+        reportProfile(options)
+        return
 
-    return
+    if options.batchRender:
+        renderQueue = rendering.RenderQueue(f'{outputDirectory}/RateCapability.root', options.formats)
+        treeExtensions, combinedPaths = options.formats, [ f'{resultsDirectory}/RateCapability.{extension}' for extension in options.formats ]
+    else:
+        renderQueue = None
+        treeExtensions, combinedPaths = ['eps', 'root'], [f'{resultsDirectory}/RateCapability.eps', f'{resultsDirectory}/RateCapability.root']
 
-    rateCapabilityGraph = rt.TMultiGraph()
-    rateCapabilityGraphs = list()
-    legend = rt.TLegend(0.2, 0.2, 0.8, 0.35)
-    colors = [rt.kBlack, rt.kRed, rt.kGreen, rt.kBlue]
-    for iMeasurement,measurementFile in enumerate(options.input):
-        title = measurementFile.split('/')[-1][:-5]
-        try: os.makedirs('%s/%s/'%(options.output, title))
-        except FileExistsError: pass
+    treeNames = measurement.Measurement.TreeNames(measurementFile)
+    staleTrees = treeNames
+    if options.incremental:
+        # skip trees whose tree content, gain file, options and outputs are unchanged since the last run:
+        buildManifest = manifest.Manifest(f'{outputDirectory}/manifest.json')
+        optionsHash = manifest.hashObject([dividerCurrent, linearizationMethod, options.fitBackend, options.chunkSize, options.resolution, options.jointFit, options.breakpoint, options.gainErrorColumn])
+        gainHash = manifest.hashFile(gainFile)
+        inputHashes = {
+            treeName: manifest.hashObject([manifest.hashTree(measurementFile, treeName), gainHash, optionsHash])
+            for treeName in treeNames
+        }
+        staleTrees = [
+            treeName for treeName in treeNames
+            if not buildManifest.IsUpToDate(treeName, inputHashes[treeName], outputPaths(outputDirectory, treeName, treeExtensions))
+        ]
+        if options.jointFit and staleTrees: staleTrees = treeNames # one changed tree changes the joint fit of all
+        print(f'{len(staleTrees)} of {len(treeNames)} trees to update:', *staleTrees)
+
+    dataTakings = dict()
+    if options.jointFit:
+        if staleTrees:
+            jointMeasurement = measurement.Measurement.FromFile(measurementFile, chamberGainCurve, dividerCurrent, linearizationMethod, options.fitBackend, options.chunkSize, options.resolution)
+            jointMeasurement.SetBreakpoint(options.breakpoint)
+            jointMeasurement.FitJoint()
+            for dataTaking in jointMeasurement:
+                dataTakings[dataTaking.name] = dataTaking
+                saveDataTaking(dataTaking, outputDirectory, renderQueue)
+    elif options.jobs>1:
+        with workers.spawnPool(options.jobs) as executor:
+            futures = [
+                executor.submit(processDataTaking, measurementFile, treeName, gainFile, dividerCurrent, linearizationMethod, options.fitBackend, outputDirectory, options.no_cache, options.chunkSize, options.resolution, renderQueue is None, profiling.enabled, options.breakpoint, options.gainErrorColumn)
+                for treeName in staleTrees
+            ]
+            for treeName,future in zip(staleTrees,futures):
+                treeResults, (hits, misses), events = future.result()
+                profiling.events += events
+                dataTakings[treeName] = measurement.DataTaking.FromResults(treeName, treeResults, chamberGainCurve, dividerCurrent, linearizationMethod, options.fitBackend, options.breakpoint)
+                if renderQueue: saveDataTaking(dataTakings[treeName], outputDirectory, renderQueue)
+                fitcache.hits, fitcache.misses = fitcache.hits+hits, fitcache.misses+misses
+    else:
+        for treeName in staleTrees: # fit current plots separately for each xray-to-chamber distance
+            dataTakings[treeName] = measurement.DataTaking.FromFile(measurementFile, treeName, chamberGainCurve, dividerCurrent, linearizationMethod, options.fitBackend, options.chunkSize, options.resolution)
+            dataTakings[treeName].breakpoint = options.breakpoint
+            '''if treeName=='Tree15cm': dataTakings[treeName].linearizationMethod = 'saturation'''
+            saveDataTaking(dataTakings[treeName], outputDirectory, renderQueue)
+    for treeName in treeNames:
+        if treeName in dataTakings: continue
+        with np.load(f'{outputDirectory}/{treeName}_Results.npz') as treeResults:
+            dataTakings[treeName] = measurement.DataTaking.FromResults(treeName, dict(treeResults), chamberGainCurve, dividerCurrent, linearizationMethod, options.fitBackend, options.breakpoint)
+    meas = measurement.Measurement([ dataTakings[treeName] for treeName in treeNames ])
+    if store: print('Results stored as run', store.Write(resultstore.Table(meas, dividerCurrents), options.run))
+
+    combinedStale = True
+    if options.incremental:
+        combinedHash = manifest.hashObject([ inputHashes[treeName] for treeName in treeNames ])
+        combinedStale = not buildManifest.IsUpToDate('RateCapability', combinedHash, combinedPaths)
+    if combinedStale:
+        if renderQueue: meas.QueuePlots(renderQueue, f'{resultsDirectory}/RateCapability')
+        else: meas.SaveRateCapability(*combinedPaths)
+    if renderQueue:
+        renderQueue.Render()
+        renderQueue.Report()
+
+    if options.incremental:
+        for treeName in staleTrees:
+            buildManifest.Update(treeName, inputHashes[treeName], outputPaths(outputDirectory, treeName, treeExtensions))
+        if combinedStale: buildManifest.Update('RateCapability', combinedHash, combinedPaths)
+        buildManifest.Save()
+
+    if options.toys:
+        with profiling.Stage('ToyMC', toys=options.toys):
+            saveToys(meas, toymc.ToyMC(meas, options.toys, options.seed, options.jobs), f'{resultsDirectory}/ToyMC.npz')
+    if options.report_cache: fitcache.report()
+    reportProfile(options)
+
+def directorySnapshot(directory):
+    return { entry.name: manifest.fileStamp(entry.path) for entry in os.scandir(directory) if entry.is_file() }
+
+def waitForChanges(directory, previous, interval, debounce):
+    # poll until the content of the directory differs from previous and then stays the same for debounce seconds,
+    # so that a burst of writes (e.g. a workbook being saved, trees being appended) is handled once
+    current = previous
+    while current==previous:
+        time.sleep(interval)
+        current = directorySnapshot(directory)
+    stableSince = time.monotonic()
+    while time.monotonic()-stableSince<debounce:
+        time.sleep(interval)
+        latest = directorySnapshot(directory)
+        if latest!=current: current, stableSince = latest, time.monotonic()
+    return current
+
+def treeLabel(workbookPath):
+    # tree name from the distance in the workbook name, e.g. RateCapability_15cm.xlsx -> Tree15cm
+    stem = os.path.splitext(os.path.basename(workbookPath))[0]
+    distance = re.search(r'\d+(\.\d+)?cm', stem)
+    return f'Tree{distance.group(0) if distance else CreateTree.branchName(stem)}'
+
+def convertWorkbooks(dataDirectory, measurementFile, gainFile, watchManifest):
+    # write a tree into the measurement file for each new or changed workbook
+    for entry in sorted(os.scandir(dataDirectory), key=lambda entry: entry.name):
+        if not entry.name.endswith('.xlsx') or entry.path==gainFile or entry.name.startswith('~$'): continue
+        workbookHash = manifest.hashFile(entry.path)
+        if watchManifest.IsUpToDate(entry.name, workbookHash, []): continue
+        treeName = treeLabel(entry.path)
+        try: columns = CreateTree.readInput(entry.path)
+        except ValueError as error: # not a measurement workbook
+            print(f'Skipping {entry.name}: {error}')
+        else:
+            print(f'Converting {entry.name} to {treeName}')
+            CreateTree.writeTreeColumnar(measurementFile, treeName, pd.DataFrame(columns), update=os.path.isfile(measurementFile))
+        watchManifest.Update(entry.name, workbookHash, [])
+    watchManifest.Save()
+
+def watch(options):
+    # convert new workbooks and update the changed trees and the combined plot whenever the data directory changes
+    dataDirectory = os.environ['RATE_CAPABILITY_DATA']
+    measurementFile, gainFile = f'{dataDirectory}/RateCapability.root', f'{dataDirectory}/EffectiveGain.xlsx'
+    outputDirectory = os.environ['RATE_CAPABILITY_OUTPUT']+'/RateCapability'
+    os.makedirs(outputDirectory, exist_ok=True)
+    watchManifest = manifest.Manifest(f'{outputDirectory}/watch.json')
+    options.incremental = True
+    snapshot = None
+    try:
+        while True:
+            if snapshot is not None: waitForChanges(dataDirectory, snapshot, options.watch, options.debounce)
+            start = time.perf_counter()
+            profiling.events = list()
+            try:
+                convertWorkbooks(dataDirectory, measurementFile, gainFile, watchManifest)
+                if os.path.isfile(measurementFile): analyze(options)
+            except Exception as exception: # e.g. a file still being written, retried at its next change
+                print(f'Update failed, {type(exception).__name__}: {exception}')
+            snapshot = directorySnapshot(dataDirectory) # our own writes do not trigger another update
+            print(f'Updated in {time.perf_counter()-start:.1f} s, watching {dataDirectory}', flush=True)
+    except KeyboardInterrupt: pass
+
+def main():
+    ap = argparse.ArgumentParser(add_help=True)
+    #ap.add_argument('--input', nargs='+')
+    #ap.add_argument('--output')
+    #ap.add_argument('--qc5')
+    ap.add_argument('--dividerCurrent', type=parseDividerCurrents, help='divider current in uA, or list/start:stop:step range for a scan')
+    ap.add_argument('--verbose', action='store_true', help='print the time spent in each stage and the status of each fit')
+    ap.add_argument('--profile', metavar='TRACE', help='also save the stage timing as chrome trace json, e.g. for chrome://tracing')
+    ap.add_argument('--jobs', type=int, default=1, help='number of worker processes, one tree per process')
+    ap.add_argument('--no-cache', action='store_true', help='parse input workbooks and refit, refreshing the caches')
+    ap.add_argument('--fitBackend', default='root', choices=['root', 'scipy'], help='library used for the linearization fits')
+    ap.add_argument('--gainErrorColumn', metavar='COLUMN', help='column of the QC5 gain errors in the Data Summary sheet, e.g. M, to weight the gain curve fit')
+    ap.add_argument('--jointFit', action='store_true', help='fit all trees at once with shared saturation time constants (scipy)')
+    ap.add_argument('--breakpoint', type=scipyfit.parseBreakpoint, default=scipyfit.defaultBreakpoint, help='xray current in uA where the anode current slope changes, or auto to detect it in each tree')
+    ap.add_argument('--chunkSize', type=int, help='stream trees in chunks of this many entries, averaging per xray current setpoint')
+    ap.add_argument('--resolution', type=float, default=setpoints.defaultResolution, help='with --chunkSize, average xray currents within this many uA as one setpoint')
+    ap.add_argument('--incremental', action='store_true', help='only refit and render trees whose inputs or outputs changed')
+    ap.add_argument('--batchRender', action='store_true', help='render all plots in one pass through a single canvas and write all ROOT objects to one file')
+    ap.add_argument('--formats', nargs='+', default=['eps'], help='image formats saved with --batchRender, e.g. eps png pdf')
+    ap.add_argument('--toys', type=int, help='propagate uncertainties with this many toys, sharded over --jobs processes')
+    ap.add_argument('--seed', type=int, help='random seed for the toys')
+    ap.add_argument('--store', help='append this run to the columnar result store in this directory')
+    ap.add_argument('--run', help='name of the run in the result store, by default the current time; without --store, the store is ResultStore in the results directory')
+    ap.add_argument('--report-cache', action='store_true', help='print fit cache hits and misses')
+    ap.add_argument('--watch', type=float, nargs='?', const=2, metavar='INTERVAL', help='keep polling the data directory every INTERVAL seconds, converting new workbooks and updating changed trees')
+    ap.add_argument('--debounce', type=float, default=3, help='seconds without further changes before a watch update')
+    options = ap.parse_args(sys.argv[1:])
+    excelcache.refresh = fitcache.refresh = options.no_cache
+    profiling.enabled = options.verbose or bool(options.profile)
+    if options.watch and options.run: ap.error('--run names a single run, it cannot be used with --watch')
 
-        meas = measurement.DataTaking(measurementFile, chamberGainCurve, options.dividerCurrent)
-        meas.SetCollimator(1)
-        #meas.SetLinearizeMethod('firstpoints')
-        meas.SaveCurrents('%s/%s/AnodeCurrent.eps'%(options.output, title), '%s/%s/AnodeCurrent.root'%(options.output, title))
-        meas.SaveEffectiveGain('%s/%s/EffectiveGain.eps'%(options.output, title), '%s/%s/EffectiveGain.root'%(options.output, title))
-        meas.SaveRateCapability('%s/%s/RateCapability.eps'%(options.output, title), '%s/%s/RateCapability.root'%(options.output, title))
-        
-        rateCapabilityGraphs.append(meas.GetRateCapabilityPlot())
-        g = rateCapabilityGraphs[-1]
-        g.SetMarkerColor(colors[iMeasurement])
-        rateCapabilityGraph.Add(g, 'p')
-        legend.AddEntry(g, title, 'p')
-
-    rateCapabilityCanvas = rt.TCanvas('RateCapabilityCanvas', '', 800, 600)
-    rateCapabilityGraph.SetTitle(';Rate (kHz/cm^{2});Effective gain')
-    rateCapabilityGraph.Draw('a')
-    rateCapabilityCanvas.SetGrid()
-    rateCapabilityCanvas.SetLogx()
-    legend.Draw()
-    rateCapabilityCanvas.SaveAs('%s/RateCapability.eps'%(options.output))
+    if options.watch: watch(options)
+    else: analyze(options)
 
 if __name__=='__main__': main()
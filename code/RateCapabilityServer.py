@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+import os, sys
+import argparse
+import asyncio
+import functools
+import json
+import time
+
+import measurement
+import fitmodels
+import scipyfit
+from concurrent.futures.process import BrokenProcessPool
+import workers
+
+# long-running analysis service for shifts: one worker process keeps ROOT, the compiled fit models, the gain curves
+# and the fitted data-takings in memory, while an asyncio loop serves requests on a unix socket (or a localhost
+# port), one json object per line and one json reply per line, e.g.
+#   {"command": "add", "trees": ["Tree15cm"], "file": "RateCapability.root"}   fit, save and re-render
+#   {"command": "remove", "trees": ["Tree15cm"]}   {"command": "render"}   {"command": "status"}   {"command": "shutdown"}
+# Requests are run one at a time by the worker, which owns all ROOT objects
+
+# state of the worker process:
+settings = dict()
+gainCurves = dict() # (gain file, modification time) -> GainCurve
+dataTakings = dict() # tree name -> DataTaking, in the order they were added
+combined = None # Measurement of the last combined plot
+
+def initWorker(workerSettings):
+    settings.update(workerSettings)
+    for directory in [settings['outputDirectory'], settings['resultsDirectory']]: os.makedirs(directory, exist_ok=True)
+
+def warmUp():
+    # import ROOT and the rendering code, compile the fit models and fit the gain curve before the first request needs them
+    start = time.perf_counter()
+    measurement.rt.TGraph # plots are drawn with ROOT whatever the fit backend
+    import RateCapability
+    if settings['fitBackend']=='root':
+        for formula, *_ in measurement.fitModels[settings['linearizationMethod']].values(): fitmodels.prototype(formula)
+    getGainCurve(settings['gainFile'])
+    return { 'warmUp': time.perf_counter()-start }
+
+def getGainCurve(gainFile):
+    # refit only when the QC5 file changes
+    key = (gainFile, os.path.getmtime(gainFile))
+    if key not in gainCurves: gainCurves[key] = measurement.GainCurve(gainFile, settings['fitBackend'], settings['gainErrorColumn'])
+    return gainCurves[key]
+
+def releaseCombined():
+    # the combined multigraph holds the graphs of the data-takings: detach them before any data-taking is dropped,
+    # otherwise deleting the multigraph would delete them too
+    global combined
+    if combined is not None: combined.Release()
+    combined = None
+
+def addTrees(file=None, trees=None, dividerCurrent=None, collimator=None, render=True):
+    # fit (or refit, e.g. after the tree was rewritten) the given trees of a file, all by default
+    from RateCapability import saveDataTaking # only in the worker, already imported by warmUp
+    file = file or settings['measurementFile']
+    trees = trees or measurement.Measurement.TreeNames(file)
+    gainCurve = getGainCurve(settings['gainFile'])
+    releaseCombined()
+    for treeName in trees:
+        dataTaking = measurement.DataTaking.FromFile(
+            file, treeName, gainCurve, dividerCurrent or settings['dividerCurrent'], settings['linearizationMethod'], settings['fitBackend']
+        )
+        dataTaking.breakpoint = settings['breakpoint']
+        if collimator is not None: dataTaking.SetCollimator(collimator)
+        dataTakings[treeName] = dataTaking
+        if render: saveDataTaking(dataTaking, settings['outputDirectory'])
+        else: dataTaking.results # fit now rather than at the next render
+    if render: renderCombined()
+    return { 'added': list(trees) }
+
+def removeTrees(trees, render=True):
+    releaseCombined()
+    for treeName in trees: dataTakings.pop(treeName)
+    if render: renderCombined()
+    return { 'removed': list(trees) }
+
+def renderCombined():
+    global combined
+    releaseCombined()
+    if not dataTakings: return { 'rendered': False }
+    combined = measurement.Measurement(list(dataTakings.values()))
+    path = f'{settings["resultsDirectory"]}/RateCapability'
+    combined.SaveRateCapability(f'{path}.eps', f'{path}.root')
+    return { 'rendered': True }
+
+def status():
+    return { 'trees': list(dataTakings), 'gainCurves': [ gainFile for gainFile,_ in gainCurves ], 'settings': settings }
+
+commands = { 'add': addTrees, 'remove': removeTrees, 'render': renderCombined, 'status': status }
+
+class Service:
+    # asyncio side: forwards each request to the worker process, restarting it if it dies
+
+    def __init__(self, workerSettings):
+        self.workerSettings = workerSettings
+        self.stopped = asyncio.Event()
+        self.StartWorker()
+
+    def StartWorker(self):
+        self.executor = workers.spawnPool(1, initializer=initWorker, initargs=(self.workerSettings,))
+        self.warmUp = self.executor.submit(warmUp)
+
+    async def Serve(self, request):
+        command = request.pop('command', None)
+        if command=='shutdown':
+            self.stopped.set()
+            return dict()
+        if command not in commands: raise ValueError(f'Unrecognized command {command}, expected one of {list(commands)} or shutdown')
+        try: return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(commands[command], **request))
+        except BrokenProcessPool:
+            self.StartWorker() # the state is lost, trees have to be added again
+            raise
+
+    async def HandleConnection(self, reader, writer):
+        while line := await reader.readline():
+            start = time.perf_counter()
+            try: reply = { 'status': 'ok', **await self.Serve(json.loads(line)) }
+            except Exception as exception: reply = { 'status': 'error', 'error': f'{type(exception).__name__}: {exception}' }
+            reply['seconds'] = time.perf_counter()-start
+            print(line.decode().strip(), '->', reply['status'], f'in {reply["seconds"]:.3f} s', flush=True)
+            writer.write((json.dumps(reply)+'\n').encode())
+            await writer.drain()
+            if self.stopped.is_set(): break
+        writer.close()
+
+async def serve(options, workerSettings):
+    service = Service(workerSettings)
+    if options.port: server = await asyncio.start_server(service.HandleConnection, '127.0.0.1', options.port)
+    else:
+        if os.path.exists(options.socket): os.remove(options.socket) # left over by a server that was killed
+        server = await asyncio.start_unix_server(service.HandleConnection, options.socket)
+    try:
+        print('Worker ready:', await asyncio.wrap_future(service.warmUp), flush=True)
+        if options.preload: print(await service.Serve({ 'command': 'add' }), flush=True)
+        print('Serving on', options.port or options.socket, flush=True)
+        async with server:
+            await service.stopped.wait()
+    finally:
+        service.executor.shutdown()
+        if not options.port: os.remove(options.socket)
+
+async def send(options, request):
+    if options.port: reader, writer = await asyncio.open_connection('127.0.0.1', options.port)
+    else: reader, writer = await asyncio.open_unix_connection(options.socket)
+    writer.write((json.dumps(request)+'\n').encode())
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    writer.close()
+    return reply
+
+def main():
+    ap = argparse.ArgumentParser(add_help=True)
+    ap.add_argument('--socket', default='/tmp/RateCapabilityServer.sock', help='unix socket to serve on')
+    ap.add_argument('--port', type=int, help='serve on this localhost tcp port instead of the unix socket')
+    ap.add_argument('--request', type=json.loads, help='send this json request to a running server, print the reply and exit')
+    ap.add_argument('--dividerCurrent', type=float, help='divider current in uA')
+    ap.add_argument('--linearizationMethod', default='piecewiseSaturation', choices=['saturation', 'firstpoints', 'saturation2part', 'piecewiseSaturation'])
+    ap.add_argument('--fitBackend', default='root', choices=['root', 'scipy'])
+    ap.add_argument('--breakpoint', type=scipyfit.parseBreakpoint, default=scipyfit.defaultBreakpoint, help='xray current in uA where the anode current slope changes, or auto')
+    ap.add_argument('--gainErrorColumn', metavar='COLUMN', help='column of the QC5 gain errors in the Data Summary sheet, to weight the gain curve fit')
+    ap.add_argument('--preload', action='store_true', help='add all trees of the measurement file at startup')
+    options = ap.parse_args(sys.argv[1:])
+
+    if options.request:
+        reply = asyncio.run(send(options, options.request))
+        print(json.dumps(reply, indent=2))
+        sys.exit(reply['status']!='ok')
+    if options.dividerCurrent is None: ap.error('--dividerCurrent is needed to start a server')
+
+    workerSettings = {
+        'measurementFile': os.environ['RATE_CAPABILITY_DATA']+'/RateCapability.root',
+        'gainFile': os.environ['RATE_CAPABILITY_DATA']+'/EffectiveGain.xlsx',
+        'resultsDirectory': os.environ['RATE_CAPABILITY_RESULTS']+'/RateCapability',
+        'outputDirectory': os.environ['RATE_CAPABILITY_OUTPUT']+'/RateCapability',
+        'dividerCurrent': options.dividerCurrent, 'linearizationMethod': options.linearizationMethod,
+        'fitBackend': options.fitBackend, 'breakpoint': options.breakpoint, 'gainErrorColumn': options.gainErrorColumn
+    }
+    asyncio.run(serve(options, workerSettings))
+
+if __name__=='__main__': main()
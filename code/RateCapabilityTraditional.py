@@ -11,52 +11,143 @@ import pandas as pd
 import root_style_cms
 
 import measurement
+import excelcache
+import fitcache
+import manifest
+import profiling
+from RateCapability import saveDataTaking, reportProfile
+import workers
+
+# compare the rate capability of several campaigns (measurement files), each with its own QC5 gain file,
+# divider current and collimator radius. Each campaign is processed in its own process and its results
+# cached, so that adding a campaign to the comparison only processes the new one
+
+colors = [rt.kBlack, rt.kRed, rt.kGreen+2, rt.kBlue, rt.kMagenta+1, rt.kOrange+7, rt.kCyan+2, rt.kViolet-1]
+markers = [20, 21, 22, 23, 33, 34, 29, 47]
+
+def campaignOptions(values, ncampaigns, name):
+    # one value for all campaigns or one per campaign
+    if len(values)==1: return values*ncampaigns
+    if len(values)!=ncampaigns: raise ValueError(f'Expected one or {ncampaigns} values for --{name}, got {len(values)}')
+    return values
+
+def campaignTitles(measurementFiles):
+    titles = [ os.path.splitext(os.path.basename(measurementFile))[0] for measurementFile in measurementFiles ]
+    return [ f'{title}_{titles[:i].count(title)}' if titles.count(title)>1 else title for i,title in enumerate(titles) ]
+
+def processCampaign(title, measurementFile, gainFile, dividerCurrent, collimatorRadius, linearizationMethod, fitBackend, outputDirectory, noCache=False, profile=False, gainErrorColumn=None):
+    # fit and save all data-takings of a campaign, a root file with one tree per distance or a single excel sheet;
+    # return the results of each data-taking as numpy arrays
+    excelcache.refresh = fitcache.refresh = noCache
+    profiling.enabled, profiling.events = profile, list()
+    gainCurve = measurement.GainCurve(gainFile, fitBackend, gainErrorColumn)
+    if measurementFile.endswith('.root'):
+        dataTakings = list(measurement.Measurement.FromFile(measurementFile, gainCurve, dividerCurrent, linearizationMethod, fitBackend))
+    else: dataTakings = [measurement.DataTaking.FromExcelFile(title, measurementFile, gainCurve, dividerCurrent, linearizationMethod, fitBackend)]
+
+    os.makedirs(f'{outputDirectory}/{title}', exist_ok=True)
+    for dataTaking in dataTakings:
+        dataTaking.SetCollimator(collimatorRadius)
+        saveDataTaking(dataTaking, f'{outputDirectory}/{title}')
+    return { dataTaking.name: dataTaking.results for dataTaking in dataTakings }, profiling.events
+
+def saveCampaign(campaignResults, path):
+    np.savez(path, names=np.array(list(campaignResults)), **{
+        f'{name}/{quantity}': values for name,results in campaignResults.items() for quantity,values in results.items()
+    })
+
+def loadCampaign(path):
+    with np.load(path) as arrays:
+        campaignResults = { str(name): dict() for name in arrays['names'] }
+        for key in arrays.files:
+            if key=='names': continue
+            name, quantity = key.split('/')
+            campaignResults[name][quantity] = arrays[key]
+    return campaignResults
 
 def main():
     ap = argparse.ArgumentParser(add_help=True)
-    ap.add_argument('--input', nargs='+')
-    ap.add_argument('--output')
-    ap.add_argument('--qc5')
-    ap.add_argument('--dividerCurrent', type=float)
-    ap.add_argument('--verbose', action='store_true')
+    ap.add_argument('--input', nargs='+', required=True, help='measurement files, root files with one tree per distance or excel workbooks')
+    ap.add_argument('--output', required=True)
+    ap.add_argument('--qc5', nargs='+', required=True, help='QC5 gain files, one for all inputs or one per input')
+    ap.add_argument('--dividerCurrent', type=float, nargs='+', required=True, help='divider currents in uA, one for all inputs or one per input')
+    ap.add_argument('--gainErrorColumn', metavar='COLUMN', help='column of the QC5 gain errors in the Data Summary sheets, e.g. M, to weight the gain curve fits')
+    ap.add_argument('--collimator', type=float, nargs='+', default=[1], help='collimator radii in cm, one for all inputs or one per input')
+    ap.add_argument('--titles', nargs='+', help='legend titles, by default the input file names')
+    ap.add_argument('--linearizationMethod', default='piecewiseSaturation', choices=['saturation', 'firstpoints', 'saturation2part', 'piecewiseSaturation'])
+    ap.add_argument('--fitBackend', default='root', choices=['root', 'scipy'])
+    ap.add_argument('--jobs', type=int, default=1, help='number of worker processes, one campaign per process')
+    ap.add_argument('--no-cache', action='store_true', help='reprocess all campaigns, refreshing the caches')
+    ap.add_argument('--verbose', action='store_true', help='print the time spent in each stage and the status of each fit')
+    ap.add_argument('--profile', metavar='TRACE', help='also save the stage timing as chrome trace json')
     options = ap.parse_args(sys.argv[1:])
+    excelcache.refresh = fitcache.refresh = options.no_cache
+    profiling.enabled = options.verbose or bool(options.profile)
+
+    ncampaigns = len(options.input)
+    gainFiles = campaignOptions(options.qc5, ncampaigns, 'qc5')
+    dividerCurrents = campaignOptions(options.dividerCurrent, ncampaigns, 'dividerCurrent')
+    collimatorRadii = campaignOptions(options.collimator, ncampaigns, 'collimator')
+    titles = options.titles or campaignTitles(options.input)
+    if len(titles)!=ncampaigns: raise ValueError(f'Expected {ncampaigns} titles, got {len(titles)}')
+    os.makedirs(options.output, exist_ok=True)
 
-    try: os.makedirs(options.output)
-    except FileExistsError: pass
+    # campaigns whose measurement, gain file and settings are unchanged are read back from their cached results:
+    buildManifest = manifest.Manifest(f'{options.output}/manifest.json')
+    campaigns = list(zip(titles, options.input, gainFiles, dividerCurrents, collimatorRadii))
+    resultPaths = { title: f'{options.output}/{title}/Results.npz' for title in titles }
+    inputHashes = {
+        title: manifest.hashObject([
+            manifest.hashFile(measurementFile), manifest.hashFile(gainFile),
+            dividerCurrent, collimatorRadius, options.linearizationMethod, options.fitBackend, options.gainErrorColumn
+        ])
+        for title,measurementFile,gainFile,dividerCurrent,collimatorRadius in campaigns
+    }
+    staleCampaigns = [
+        campaign for campaign in campaigns
+        if options.no_cache or not buildManifest.IsUpToDate(campaign[0], inputHashes[campaign[0]], [resultPaths[campaign[0]]])
+    ]
+    print(f'{len(staleCampaigns)} of {ncampaigns} campaigns to process:', *[ campaign[0] for campaign in staleCampaigns ])
 
-    chamberGainCurve = measurement.GainCurve(options.qc5)
-    chamberGain = chamberGainCurve.Get(options.dividerCurrent)
-    print('%d chamber gain'%(chamberGain))
+    arguments = [ (*campaign, options.linearizationMethod, options.fitBackend, options.output, options.no_cache, profiling.enabled, options.gainErrorColumn) for campaign in staleCampaigns ]
+    if options.jobs>1:
+        with workers.spawnPool(options.jobs) as executor:
+            processed = list(executor.map(processCampaign, *zip(*arguments))) if arguments else list()
+    else: processed = [ processCampaign(*campaignArguments) for campaignArguments in arguments ]
+    for campaign,(campaignResults,events) in zip(staleCampaigns, processed):
+        title = campaign[0]
+        saveCampaign(campaignResults, resultPaths[title])
+        buildManifest.Update(title, inputHashes[title], [resultPaths[title]])
+        profiling.events += events
+    buildManifest.Save()
 
     rateCapabilityGraph = rt.TMultiGraph()
-    rateCapabilityGraphs = list()
+    rateCapabilityGraph.SetName('RateCapabilityPlot')
+    rateCapabilityGraph.SetTitle(';Rate (kHz/cm^{2});Effective gain (#times 10^{4})')
     legend = rt.TLegend(0.2, 0.2, 0.8, 0.35)
-    colors = [rt.kBlack, rt.kRed, rt.kGreen, rt.kBlue]
-    for iMeasurement,measurementFile in enumerate(options.input):
-        title = measurementFile.split('/')[-1][:-5]
-        try: os.makedirs('%s/%s/'%(options.output, title))
-        except FileExistsError: pass
-
-        meas = measurement.DataTaking(measurementFile, chamberGainCurve, options.dividerCurrent)
-        meas.SetCollimator(1)
-        #meas.SetLinearizeMethod('firstpoints')
-        meas.SaveCurrents('%s/%s/AnodeCurrent.eps'%(options.output, title), '%s/%s/AnodeCurrent.root'%(options.output, title))
-        meas.SaveRate('%s/%s/Rate.eps'%(options.output, title), '%s/%s/Rate.root'%(options.output, title))
-        meas.SaveEffectiveGain('%s/%s/EffectiveGain.eps'%(options.output, title), '%s/%s/EffectiveGain.root'%(options.output, title))
-        meas.SaveRateCapability('%s/%s/RateCapability.eps'%(options.output, title), '%s/%s/RateCapability.root'%(options.output, title))
-        
-        rateCapabilityGraphs.append(meas.GetRateCapabilityPlot())
-        g = rateCapabilityGraphs[-1]
-        g.SetMarkerColor(colors[iMeasurement])
-        rateCapabilityGraph.Add(g, 'p')
-        legend.AddEntry(g, title, 'p')
+    legend.SetNColumns(2 if ncampaigns>4 else 1)
+    dataTakings = list() # keep graphs alive until the canvas is saved
+    for icampaign,(title,measurementFile,gainFile,dividerCurrent,collimatorRadius) in enumerate(campaigns):
+        campaignResults = loadCampaign(resultPaths[title])
+        for itaking,(name,results) in enumerate(campaignResults.items()):
+            # only the cached derived quantities are drawn, no gain curve is needed
+            dataTaking = measurement.DataTaking.FromResults(name, results, None, dividerCurrent, options.linearizationMethod, options.fitBackend)
+            dataTakings.append(dataTaking)
+            g = dataTaking.rateCapabilityPlot
+            g.SetName(f'{title}_{name}')
+            g.SetMarkerColor(colors[icampaign%len(colors)])
+            g.SetLineColor(colors[icampaign%len(colors)])
+            g.SetMarkerStyle(markers[itaking%len(markers)])
+            rateCapabilityGraph.Add(g, 'p')
+            legend.AddEntry(g, title if name==title else f'{title} {name}', 'p')
 
     rateCapabilityCanvas = rt.TCanvas('RateCapabilityCanvas', '', 800, 600)
-    rateCapabilityGraph.SetTitle(';Rate (Hz/mm^{2});Effective gain')
     rateCapabilityGraph.Draw('a')
     rateCapabilityCanvas.SetGrid()
     rateCapabilityCanvas.SetLogx()
     legend.Draw()
-    rateCapabilityCanvas.SaveAs('%s/RateCapability.eps'%(options.output))
+    rateCapabilityGraph.SaveAs(f'{options.output}/RateCapability.root')
+    rateCapabilityCanvas.SaveAs(f'{options.output}/RateCapability.eps')
+    reportProfile(options)
 
 if __name__=='__main__': main()
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+import os, sys
+import argparse
+
+import numpy as np
+
+import measurement
+
+def main():
+    # compare the linearized anode current of the scipy fit backend against the ROOT one
+    ap = argparse.ArgumentParser(add_help=True)
+    ap.add_argument('--input', default=os.environ.get('RATE_CAPABILITY_DATA', '.')+'/RateCapability.root')
+    ap.add_argument('--qc5', default=os.environ.get('RATE_CAPABILITY_DATA', '.')+'/EffectiveGain.xlsx')
+    ap.add_argument('--dividerCurrent', type=float)
+    ap.add_argument('--method', default='piecewiseSaturation', choices=['saturation', 'firstpoints', 'saturation2part', 'piecewiseSaturation'])
+    ap.add_argument('--tolerance', type=float, default=1e-3, help='maximum relative difference of the linearized current')
+    options = ap.parse_args(sys.argv[1:])
+
+    gainCurve = measurement.GainCurve(options.qc5)
+    measurements = {
+        backend: measurement.Measurement.FromFile(options.input, gainCurve, options.dividerCurrent, options.method, backend)
+        for backend in ['root', 'scipy']
+    }
+
+    passed = True
+    for rootDataTaking,scipyDataTaking in zip(measurements['root'], measurements['scipy']):
+        rootLinearized, errRootLinearized = rootDataTaking.anodeCurrentLinearized
+        scipyLinearized, errScipyLinearized = scipyDataTaking.anodeCurrentLinearized
+        difference = np.max(np.abs(scipyLinearized/rootLinearized-1))
+        errDifference = np.max(np.abs(errScipyLinearized/errRootLinearized-1))
+        for fitName,rootFit in rootDataTaking.fitResults.items():
+            scipyFit = scipyDataTaking.fitResults[fitName]
+            print(f'{rootDataTaking.name} {fitName} root:  ', rootFit['parameters'])
+            print(f'{rootDataTaking.name} {fitName} scipy: ', scipyFit['parameters'])
+        print(f'{rootDataTaking.name}: linearized current differs by {difference:.2e}, its error by {errDifference:.2e}')
+        passed = passed and difference<=options.tolerance
+    print('Validation', 'passed' if passed else 'failed')
+    sys.exit(0 if passed else 1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+import os, sys
+import argparse
+import glob
+import json
+import resource
+import shutil
+import subprocess
+import time
+
+import numpy as np
+
+from lazyroot import rt
+
+# regression check of the pipeline against the reference outputs shipped with the repository: runs RateCapability.py
+# into a candidate directory, compares the points and errors of every graph (also inside multigraphs) of every
+# root file with per-quantity tolerances, and records the wall time and peak memory of the run
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# quantity (plot name in the file name) -> relative tolerance on point values and on errors:
+defaultTolerances = {
+    'AnodeCurrent': (1e-6, 1e-6), 'Rate': (1e-4, 1e-3), 'EffectiveGain': (1e-4, 1e-3), 'RateCapability': (1e-4, 1e-3)
+}
+
+def parseTolerance(value):
+    # QUANTITY=VALUE or QUANTITY=VALUE,ERROR
+    quantity, tolerances = value.split('=')
+    tolerances = [ float(tolerance) for tolerance in tolerances.split(',') ]
+    return quantity, (tolerances[0], tolerances[-1])
+
+def graphPoints(graph):
+    n = graph.GetN()
+    x, y = np.fromiter(graph.GetX(), float, n), np.fromiter(graph.GetY(), float, n)
+    if graph.InheritsFrom('TGraphErrors'): ex, ey = np.fromiter(graph.GetEX(), float, n), np.fromiter(graph.GetEY(), float, n)
+    else: ex, ey = np.zeros(n), np.zeros(n)
+    return { 'x': x, 'y': y, 'ex': ex, 'ey': ey }
+
+def readPoints(path):
+    # graph name -> points of every graph in the file, graphs of a multigraph named multigraph/index
+    rootFile = rt.TFile(path, 'READ')
+    points = dict()
+    for key in rootFile.GetListOfKeys():
+        obj = key.ReadObj()
+        if obj.InheritsFrom('TMultiGraph'):
+            for igraph,graph in enumerate(obj.GetListOfGraphs()): points[f'{key.GetName()}/{igraph}'] = graphPoints(graph)
+        elif obj.InheritsFrom('TGraph'): points[key.GetName()] = graphPoints(obj)
+    rootFile.Close()
+    return points
+
+def relativeDifference(reference, candidate):
+    scale = np.maximum(np.abs(reference), np.abs(candidate))
+    return float(np.max(np.abs(candidate-reference)/np.where(scale>0, scale, 1), initial=0))
+
+def compareFile(referencePath, candidatePath, tolerances):
+    # list of (graph, failure or None, max relative difference of values, of errors)
+    quantity = os.path.splitext(os.path.basename(referencePath))[0].split('_')[-1]
+    valueTolerance, errorTolerance = tolerances.get(quantity, tolerances['RateCapability'])
+    if not os.path.isfile(candidatePath): return [('', 'missing file', np.nan, np.nan)]
+    referencePoints, candidatePoints = readPoints(referencePath), readPoints(candidatePath)
+    comparisons = list()
+    for name in sorted(set(referencePoints)|set(candidatePoints)):
+        if name not in candidatePoints or name not in referencePoints:
+            comparisons.append((name, 'missing graph' if name in referencePoints else 'extra graph', np.nan, np.nan))
+            continue
+        reference, candidate = referencePoints[name], candidatePoints[name]
+        if len(reference['x'])!=len(candidate['x']):
+            comparisons.append((name, f'{len(candidate["x"])} points instead of {len(reference["x"])}', np.nan, np.nan))
+            continue
+        valueDifference = max(relativeDifference(reference[axis], candidate[axis]) for axis in ['x', 'y'])
+        errorDifference = max(relativeDifference(reference[axis], candidate[axis]) for axis in ['ex', 'ey'])
+        failure = None
+        if valueDifference>valueTolerance: failure = f'values differ by {valueDifference:.2e} > {valueTolerance:.0e}'
+        elif errorDifference>errorTolerance: failure = f'errors differ by {errorDifference:.2e} > {errorTolerance:.0e}'
+        comparisons.append((name, failure, valueDifference, errorDifference))
+    return comparisons
+
+def runPipeline(candidateDirectory, pipelineArguments):
+    # run RateCapability.py writing into the candidate directory, return wall time in s and peak memory in MB
+    environment = dict(os.environ)
+    environment['RATE_CAPABILITY_OUTPUT'], environment['RATE_CAPABILITY_RESULTS'] = f'{candidateDirectory}/output', f'{candidateDirectory}/results'
+    command = [sys.executable, f'{repository}/code/RateCapability.py', *pipelineArguments]
+    print(' '.join(command))
+    start = time.perf_counter()
+    subprocess.run(command, env=environment, cwd=f'{repository}/code', check=True)
+    seconds = time.perf_counter()-start
+    # largest resident set of the pipeline process or of any of its worker processes, kB on linux:
+    peakRss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024
+    return command, seconds, peakRss
+
+def updateReferences(candidateDirectory, referenceOutput, referenceResults):
+    # replace the reference outputs with those of the candidate run, e.g. after an intended change of the results
+    for referenceDirectory,candidateSubdirectory in [(referenceOutput, 'output'), (referenceResults, 'results')]:
+        for referencePath in sorted(glob.glob(f'{referenceDirectory}/*.root')+glob.glob(f'{referenceDirectory}/*.eps')):
+            candidatePath = f'{candidateDirectory}/{candidateSubdirectory}/RateCapability/{os.path.basename(referencePath)}'
+            if not os.path.isfile(candidatePath): raise FileNotFoundError(f'{candidatePath} missing, references left unchanged from here')
+            shutil.copyfile(candidatePath, referencePath)
+            print('Updated', referencePath)
+
+def main():
+    ap = argparse.ArgumentParser(add_help=True, epilog='arguments after -- are passed to RateCapability.py, e.g. -- --dividerCurrent 700 --jobs 4')
+    ap.add_argument('--candidate', required=True, help='directory the fresh run writes its output and results directories to')
+    ap.add_argument('--referenceOutput', default=f'{repository}/output/RateCapability')
+    ap.add_argument('--referenceResults', default=f'{repository}/results/RateCapability')
+    ap.add_argument('--no-run', action='store_true', help='compare an existing candidate directory without running the pipeline')
+    ap.add_argument('--tolerance', type=parseTolerance, action='append', default=list(), metavar='QUANTITY=VALUE[,ERROR]', help='relative tolerances of a quantity, e.g. Rate=1e-3,1e-2')
+    ap.add_argument('--baseline', help='report of an earlier run, e.g. before a change, to compare wall time and memory with')
+    ap.add_argument('--report', help='json report of this check, by default Regression.json in the candidate directory')
+    ap.add_argument('--update', action='store_true', help='copy the candidate outputs over the reference ones after the run, instead of comparing them')
+    ap.add_argument('pipelineArguments', nargs=argparse.REMAINDER)
+    options = ap.parse_args(sys.argv[1:])
+    tolerances = { **defaultTolerances, **dict(options.tolerance) }
+    pipelineArguments = options.pipelineArguments[1:] if options.pipelineArguments[:1]==['--'] else options.pipelineArguments
+
+    report = { 'candidate': options.candidate, 'tolerances': tolerances }
+    if not options.no_run:
+        report['command'], report['seconds'], report['peakRssMB'] = runPipeline(options.candidate, pipelineArguments)
+        print(f'Pipeline ran in {report["seconds"]:.2f} s, peak RSS {report["peakRssMB"]:.1f} MB')
+
+    if options.update:
+        updateReferences(options.candidate, options.referenceOutput, options.referenceResults)
+        return
+
+    filePairs = [
+        (referencePath, f'{options.candidate}/output/RateCapability/{os.path.basename(referencePath)}')
+        for referencePath in sorted(glob.glob(f'{options.referenceOutput}/*.root'))
+    ] + [(f'{options.referenceResults}/RateCapability.root', f'{options.candidate}/results/RateCapability/RateCapability.root')]
+    passed, report['differences'] = True, dict()
+    for referencePath,candidatePath in filePairs:
+        for name,failure,valueDifference,errorDifference in compareFile(referencePath, candidatePath, tolerances):
+            label = f'{os.path.basename(referencePath)} {name}'
+            print(f'{label:>50s}: {"FAILED, "+failure if failure else "ok"} (values {valueDifference:.1e}, errors {errorDifference:.1e})')
+            report['differences'][label] = { 'failure': failure, 'values': valueDifference, 'errors': errorDifference }
+            passed = passed and failure is None
+    report['passed'] = passed
+
+    if options.baseline and not options.no_run:
+        with open(options.baseline) as f: baseline = json.load(f)
+        report['baseline'] = { quantity: baseline.get(quantity) for quantity in ['command', 'seconds', 'peakRssMB'] }
+        if baseline.get('seconds'):
+            print(f'Wall time {report["seconds"]:.2f} s vs {baseline["seconds"]:.2f} s in the baseline ({baseline["seconds"]/report["seconds"]:.2f}x faster)')
+            print(f'Peak RSS {report["peakRssMB"]:.1f} MB vs {baseline["peakRssMB"]:.1f} MB in the baseline')
+    reportPath = options.report or f'{options.candidate}/Regression.json'
+    os.makedirs(os.path.dirname(os.path.abspath(reportPath)), exist_ok=True)
+    with open(reportPath, 'w') as f: json.dump(report, f, indent=2)
+    print('Regression check', 'passed' if passed else 'failed', '- report saved to', reportPath)
+    sys.exit(0 if passed else 1)
+
+if __name__=='__main__': main()
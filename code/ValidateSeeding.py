@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+import os, sys
+import argparse
+
+import numpy as np
+
+import profiling
+import scipyfit
+import synthetic
+
+# compare the closed-form seeding of the linearization fits with the former range fits on synthetic
+# campaigns with random setpoint grids: function calls of all fits, including seed fits, and failed fits
+
+def randomGrid(generator):
+    # setpoints as in a new campaign: random number, range and spacing, rounded to 0.1 uA
+    npoints = generator.integers(6, 30)
+    xmin, xmax = generator.uniform(0.5, 10), generator.uniform(120, 250)
+    xray = np.round(np.sort(generator.uniform(xmin, xmax, npoints)), 1)
+    return np.unique(xray)
+
+def runFits(data, method, seeding, breakpoint):
+    profiling.events = list()
+    fitResults = scipyfit.FitAnodeCurrent(*data, method, breakpoint, seeding)
+    calls = sum(event['args'].get('calls', 0) for event in profiling.events)
+    final = profiling.events[-1]['args'] if profiling.events else dict() # no final fit with too few points in range
+    parameters = np.concatenate([ fitResult['parameters'] for fitResult in fitResults.values() ])
+    return calls, final, parameters
+
+def main():
+    ap = argparse.ArgumentParser(add_help=True)
+    ap.add_argument('--campaigns', type=int, default=500)
+    ap.add_argument('--methods', nargs='+', default=['saturation', 'saturation2part', 'piecewiseSaturation'])
+    ap.add_argument('--maxChi2', type=float, default=3, help='chi2/ndf above which a fit counts as failed')
+    ap.add_argument('--detectBreakpoint', action='store_true', help='detect the breakpoint instead of using the true one')
+    ap.add_argument('--seed', type=int, default=0)
+    options = ap.parse_args(sys.argv[1:])
+    profiling.enabled = True
+
+    generator = np.random.default_rng(options.seed)
+    campaigns = list()
+    for icampaign in range(options.campaigns):
+        xray = randomGrid(generator)
+        df = synthetic.SaturatingCurve(0, generator.uniform(15, 110), generator=generator, xray=xray)
+        campaigns.append((df['XrayCurrent'].values, df['ERR XrayCurrent'].values, np.abs(df['Ianode'].values), df['ERR Ianode'].values))
+
+    print(f'{"method":>20s} {"seeding":>11s} {"calls":>8s} {"median":>8s} {"failed":>8s}')
+    for method in options.methods:
+        for seeding in ['rangeFits', 'closedForm']:
+            calls, failed = list(), 0
+            for data in campaigns:
+                breakpoint = scipyfit.DetectBreakpoint(data[0], *data[2:]) if options.detectBreakpoint else scipyfit.defaultBreakpoint
+                try: ncalls, final, parameters = runFits(data, method, seeding, breakpoint)
+                except (ValueError, np.linalg.LinAlgError):
+                    failed += 1
+                    continue
+                calls.append(ncalls)
+                if final.get('status', 0)<=0 or not np.all(np.isfinite(parameters)) or final['chi2']>options.maxChi2*max(final['ndf'], 1): failed += 1
+            print(f'{method:>20s} {seeding:>11s} {np.mean(calls):8.1f} {np.median(calls):8.1f} {failed/len(campaigns):8.1%}')
+
+if __name__=='__main__': main()
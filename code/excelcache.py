@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# on-disk cache of parsed excel sheets, stored as npz so that reruns skip openpyxl entirely
+cacheDirectory = os.environ.get('RATE_CAPABILITY_CACHE', os.path.expanduser('~/.cache/me0-rate-capability'))
+maxCacheSize = 256*1024**2 # bytes, least recently used entries are evicted above this
+refresh = False # set to True to ignore existing entries and parse again
+
+def cacheKey(inputFile, **kwargs):
+    inputFile = os.path.abspath(inputFile)
+    stat = os.stat(inputFile)
+    key = json.dumps([inputFile, stat.st_mtime_ns, stat.st_size, sorted(kwargs.items())], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def evict(directory=None):
+    directory = directory or cacheDirectory
+    entries = [ entry for entry in os.scandir(directory) if entry.name.endswith('.npz') and entry.is_file() ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    cacheSize = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if cacheSize<=maxCacheSize: break
+        cacheSize -= entry.stat().st_size
+        os.remove(entry.path)
+
+def load(cachePath):
+    with np.load(cachePath, allow_pickle=False) as cached:
+        columns = json.loads(str(cached['columns']))
+        df = pd.DataFrame({ col: cached[f'column{icol}'] for icol,col in enumerate(columns) })
+    os.utime(cachePath) # mark as recently used
+    return df
+
+def save(cachePath, df):
+    try: arrays = { f'column{icol}': np.asarray(df[col], dtype='float64') for icol,col in enumerate(df.columns) }
+    except (TypeError, ValueError): return # non-numeric sheet, do not cache
+    os.makedirs(cacheDirectory, exist_ok=True)
+    temporaryPath = f'{cachePath}.{os.getpid()}.tmp.npz'
+    np.savez(temporaryPath, columns=np.array(json.dumps(list(df.columns), default=int)), **arrays)
+    os.replace(temporaryPath, cachePath)
+    evict()
+
+def readExcel(inputFile, **kwargs):
+    # drop-in replacement for pd.read_excel returning float64 columns
+    cachePath = f'{cacheDirectory}/{cacheKey(inputFile, **kwargs)}.npz'
+    if not refresh and os.path.isfile(cachePath):
+        try:
+            with profiling.Stage('readExcel (cached)', file=os.path.basename(inputFile)): return load(cachePath)
+        except (OSError, ValueError, KeyError): pass # corrupted entry, parse again
+    with profiling.Stage('readExcel', file=os.path.basename(inputFile)): df = pd.read_excel(inputFile, **kwargs)
+    save(cachePath, df)
+    return df
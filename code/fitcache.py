@@ -0,0 +1,51 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import excelcache
+
+# content-addressed cache of fit results (parameters, errors, covariance) keyed on the fitted data and model
+cacheDirectory = f'{excelcache.cacheDirectory}/fits'
+refresh = False # set to True to refit and overwrite existing entries
+hits, misses = 0, 0
+
+def fitKey(arrays, description):
+    digest = hashlib.sha1()
+    for array in arrays: digest.update(np.ascontiguousarray(array, dtype='float64').tobytes())
+    digest.update(json.dumps(description, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def load(key):
+    # return dict fit name -> { parameters, errors, covariance } or None if not cached
+    global hits, misses
+    cachePath = f'{cacheDirectory}/{key}.npz'
+    if refresh or not os.path.isfile(cachePath):
+        misses += 1
+        return None
+    try:
+        with np.load(cachePath, allow_pickle=False) as cached:
+            fitResults = dict()
+            for fitName in json.loads(str(cached['fits'])):
+                fitResults[fitName] = { quantity: cached[f'{fitName}_{quantity}'] for quantity in ['parameters', 'errors', 'covariance'] }
+    except (OSError, ValueError, KeyError): # corrupted entry, fit again
+        misses += 1
+        return None
+    os.utime(cachePath) # mark as recently used
+    hits += 1
+    return fitResults
+
+def save(key, fitResults):
+    os.makedirs(cacheDirectory, exist_ok=True)
+    cachePath = f'{cacheDirectory}/{key}.npz'
+    arrays = dict()
+    for fitName,fitResult in fitResults.items():
+        for quantity,values in fitResult.items(): arrays[f'{fitName}_{quantity}'] = np.asarray(values, dtype='float64')
+    temporaryPath = f'{cachePath}.{os.getpid()}.tmp.npz'
+    np.savez(temporaryPath, fits=np.array(json.dumps(list(fitResults))), **arrays)
+    os.replace(temporaryPath, cachePath)
+    excelcache.evict(cacheDirectory)
+
+def report():
+    print(f'Fit cache: {hits} hits, {misses} misses')
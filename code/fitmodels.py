@@ -0,0 +1,36 @@
+import time
+
+from lazyroot import rt
+import profiling
+
+# registry of the TF1 fit models: each formula is parsed and jit-compiled once per process into a prototype,
+# and every fit gets a copy of it. Copies share the compiled function, so only the first data-taking
+# pays the compilation, and neither prototypes nor copies are registered in ROOT's global list of functions
+
+prototypes = dict() # formula -> compiled TF1
+compileTimes = dict() # formula -> seconds spent compiling it
+
+def prototype(formula):
+    try: return prototypes[formula]
+    except KeyError: pass
+
+    with profiling.Stage('Compile fit model', formula=formula):
+        start = time.perf_counter()
+        addToGlobalList = rt.TF1.DefaultAddToGlobalList(False)
+        try:
+            function = rt.TF1(f'model{len(prototypes)}', formula, 0, 1)
+            function.Eval(0) # make sure the formula is compiled now rather than at the first fit
+        finally: rt.TF1.DefaultAddToGlobalList(addToGlobalList)
+        compileTimes[formula] = time.perf_counter()-start
+    prototypes[formula] = function
+    return function
+
+def Model(name, formula, xmin, xmax, parameterNames=None):
+    # fresh TF1 of the formula in [xmin, xmax], with all parameters free and zero
+    addToGlobalList = rt.TF1.DefaultAddToGlobalList(False)
+    try: function = rt.TF1(prototype(formula))
+    finally: rt.TF1.DefaultAddToGlobalList(addToGlobalList)
+    function.SetName(name)
+    function.SetRange(xmin, xmax)
+    if parameterNames: function.SetParNames(*parameterNames)
+    return function
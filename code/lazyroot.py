@@ -0,0 +1,14 @@
+import sys
+
+class LazyROOT:
+    # stand-in for the ROOT module: PyROOT (and the CMS style) is only imported
+    # the first time an attribute is accessed, e.g. when a plot is drawn
+    def __getattr__(self, name):
+        import ROOT
+        import root_style_cms
+        return getattr(ROOT, name)
+
+def isLoaded():
+    return 'ROOT' in sys.modules
+
+rt = LazyROOT()
@@ -0,0 +1,60 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from lazyroot import rt
+import measurement
+
+# build manifest for incremental re-analysis: for each target (a tree, or the combined plot) it records
+# the hash of its inputs and the size and modification time of the outputs written from them
+
+def hashObject(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+def hashFile(path, blockSize=1024**2):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''): digest.update(block)
+    return digest.hexdigest()
+
+def hashTree(file, treeName, chunkSize=100000):
+    # content hash of all branches of a tree, read in chunks
+    rootFile = rt.TFile(file, 'READ')
+    branches = sorted(branch.GetName() for branch in rootFile.Get(treeName).GetListOfBranches())
+    rootFile.Close()
+    digest = hashlib.sha1(json.dumps(branches).encode())
+    for chunk in measurement.iterateTree(file, treeName, branches, chunkSize):
+        for branch in branches: digest.update(np.ascontiguousarray(chunk[branch], dtype='float64').tobytes())
+    return digest.hexdigest()
+
+def fileStamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+class Manifest:
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f: self.targets = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError): self.targets = dict()
+
+    def IsUpToDate(self, target, inputHash, outputPaths):
+        try: entry = self.targets[target]
+        except KeyError: return False
+        if entry['inputHash']!=inputHash or sorted(entry['outputs'])!=sorted(outputPaths): return False
+        for outputPath,stamp in entry['outputs'].items():
+            try:
+                if fileStamp(outputPath)!=stamp: return False
+            except FileNotFoundError: return False
+        return True
+
+    def Update(self, target, inputHash, outputPaths):
+        self.targets[target] = { 'inputHash': inputHash, 'outputs': { outputPath: fileStamp(outputPath) for outputPath in outputPaths } }
+
+    def Save(self):
+        temporaryPath = f'{self.path}.tmp'
+        with open(temporaryPath, 'w') as f: json.dump(self.targets, f, indent=2)
+        os.replace(temporaryPath, self.path)
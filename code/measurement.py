@@ -5,68 +5,222 @@ import argparse
 import re
 
 import numpy as np
-import ROOT as rt
 import pandas as pd
 
-import root_style_cms
+from lazyroot import rt
+import excelcache
+import fitcache
+import fitmodels
+import profiling
+import scipyfit
+import setpoints
 
 qe, primaries, errPrimaries = 1.6e-19, 418, 9
 
+# fit models used to linearize the anode current, as TF1 formulas:
+linearFormula = '[0]*x+[1]'
+saturationFormula = '([0]*x+[1])/(1+([0]*x+[1])*[2])'
+shiftedSaturationFormula = '([0]*(x-[3])+[1])/(1+([0]*(x-[3])+[1])*[2])+[4]'
+piecewiseSaturationFormula = '([0]*x+[1])/(1+([0]*x+[1])*[2])*(x<[3])' + \
+    '+([0]*[3]+[1]+[4]*(x-[3])+[5])/(1+([0]*[3]+[1])*[2]+([4]*(x-[3])+[5])*[6])*(x>[3])'
+
+# formulas, ranges and fixed parameters of each linearization method, used as fit cache key:
+fitModels = {
+    'saturation': { 'p': [saturationFormula, 0, 200, {1: 0}] },
+    'firstpoints': { 'p': [linearFormula, 0, 30, {}] },
+    'saturation2part': { 'p1': [saturationFormula, 0.1, 'separation', {1: 0}], 'p2': [shiftedSaturationFormula, 'upper', 200, {3: 'breakpoint'}] },
+    'piecewiseSaturation': { 'p1': [piecewiseSaturationFormula, 0, 200, {3: 'breakpoint'}] }
+}
+parameterNames = { piecewiseSaturationFormula: ['A1', 'B1', 't1', 'x0', 'A2', 'B2', 't2'] }
+
+def getFitResult(fit, fitResultPtr):
+    # extract parameters, errors and covariance of a fit (with option 'S') as numpy arrays
+    npar = fit.GetNpar()
+    parameters = np.array([ fit.GetParameter(i) for i in range(npar) ])
+    errors = np.array([ fit.GetParError(i) for i in range(npar) ])
+    fitResult = fitResultPtr.Get()
+    if fitResult:
+        covariance = np.array([ [ fitResult.CovMatrix(i, j) for j in range(npar) ] for i in range(npar) ])
+        profiling.Annotate(status=fitResult.Status(), calls=fitResult.NCalls(), chi2=fitResult.Chi2(), ndf=fitResult.Ndf())
+    else: covariance = np.zeros((npar, npar))
+    return { 'parameters': parameters, 'errors': errors, 'covariance': covariance }
+
+def iterateTree(file, treeName, columns, chunkSize):
+    # read only the given branches, chunkSize entries at a time, as dicts of float64 numpy arrays; each chunk is read
+    # starting from its first entry, whereas an RDataFrame Range would run over all the entries before it every time
+    rootFile = rt.TFile(file, 'READ')
+    tree = rootFile.Get(treeName)
+    tree.SetEstimate(chunkSize) # size of the buffers filled by Draw
+    try:
+        for start in range(0, tree.GetEntries(), chunkSize):
+            nread = tree.Draw(':'.join(columns), '', 'goff para', chunkSize, start)
+            if nread<0: raise ValueError(f'Cannot read {columns} from {treeName} in {file}')
+            chunk = dict()
+            for icolumn,column in enumerate(columns):
+                values = tree.GetVal(icolumn)
+                values.reshape((nread,))
+                chunk[column] = np.array(values, dtype='float64') # copied, the buffer is reused by the next Draw
+            yield chunk
+    finally: rootFile.Close()
+
+def linearizeCurrent(linearizationMethod, parameters, xray, nominalXray=None):
+    # linearized anode current from the fit parameters (dict fit name -> parameter array);
+    # parameter arrays may carry leading dimensions, e.g. one row per toy, broadcast against xray.
+    # The pieces are selected on nominalXray, so that smeared xray currents keep the same split
+    if nominalXray is None: nominalXray = xray
+    if linearizationMethod in ['saturation', 'firstpoints']:
+        A, B = parameters['p'][...,0,None], parameters['p'][...,1,None]
+        return A*xray+B
+    elif linearizationMethod=='saturation2part':
+        separationXrayCurrent = scipyfit.separationXrayCurrent(nominalXray, np.ravel(parameters['p2'][...,3])[0]) # shift is the breakpoint
+        A1, B1 = parameters['p1'][...,0,None], parameters['p1'][...,1,None]
+        A2, B2, shift2, offset2 = [ parameters['p2'][...,ipar,None] for ipar in [0, 1, 3, 4] ]
+        return np.where(nominalXray<=separationXrayCurrent, A1*xray+B1, offset2 + A2*(xray-shift2)+B2)
+    elif linearizationMethod=='piecewiseSaturation':
+        A1, B1, x0, A2, B2 = [ parameters['p1'][...,ipar,None] for ipar in [0, 1, 3, 4, 5] ]
+        return (A1*xray+B1)*(nominalXray<=x0) + (A1*x0+B1 + A2*(xray-x0)+B2)*(nominalXray>x0)
+    else: raise ValueError('Unrecognized current linearization method')
+
+# derived quantities, written to broadcast over arrays (e.g. divider currents x xray currents):
+def computeRate(anodeCurrent, errAnodeCurrent, gain, errGain): # hit rate on chamber in Hz
+    rate = anodeCurrent/(qe*primaries*gain)
+    errRate = rate * np.sqrt((errAnodeCurrent/anodeCurrent)**2 + (errGain/gain)**2)
+    return rate, errRate
+
+def computeEffectiveGain(anodeCurrent, errAnodeCurrent, rate, errRate):
+    effectiveGain = anodeCurrent/(qe*primaries*rate)
+    errEffectiveGain = effectiveGain * ((errAnodeCurrent/anodeCurrent)**2+(errRate/rate)**2)**0.5
+    return effectiveGain, errEffectiveGain
+
 class GainCurve:
-    def __init__(self, inputFile):
-        df = pd.read_excel(inputFile, sheet_name='Data Summary', usecols='E,L', skiprows=29, nrows=15, header=None)
-        dividerCurrent, gain = np.array(df[4], dtype='float'), np.array(df[11])
-        self.gainPlot = rt.TGraph(len(gain), dividerCurrent, gain)
-        self.gainPlotFit = rt.TF1('e', 'expo(0)')
-        self.gainPlot.Fit(self.gainPlotFit)
-        self.A, self.B = self.gainPlotFit.GetParameter(0), self.gainPlotFit.GetParameter(1)
-        self.errA, self.errB = self.gainPlotFit.GetParError(0), self.gainPlotFit.GetParError(1)
+    @profiling.Timed
+    def __init__(self, inputFile, fitBackend='root', errorColumn=None):
+        # errorColumn is the column with the QC5 gain errors, if any, in which case the fit is weighted
+        columns = ['E', 'L']+([errorColumn] if errorColumn else [])
+        df = excelcache.readExcel(inputFile, sheet_name='Data Summary', usecols=','.join(columns), skiprows=29, nrows=15, header=None)
+        self.dividerCurrent, self.gain = np.array(df[4], dtype='float'), np.array(df[11], dtype='float')
+        if errorColumn:
+            from openpyxl.utils import column_index_from_string
+            self.errGain = np.array(df[column_index_from_string(errorColumn.upper())-1], dtype='float')
+        else: self.errGain = None
+        if fitBackend=='root':
+            self.gainPlotFit = fitmodels.Model('e', 'expo(0)', self.dividerCurrent.min(), self.dividerCurrent.max())
+            fitResult = getFitResult(self.gainPlotFit, self.gainPlot.Fit(self.gainPlotFit, 'S'))
+            (self.A, self.B), (self.errA, self.errB) = fitResult['parameters'], fitResult['errors']
+            self._covariance = fitResult['covariance']
+        elif fitBackend=='scipy':
+            (self.A, self.B), self._covariance = scipyfit.FitExponential(self.dividerCurrent, self.gain, self.errGain)
+            self.errA, self.errB = np.sqrt(np.diag(self._covariance))
+        else: raise ValueError('Unrecognized fit backend')
         '''c = rt.TCanvas('c', '', 800, 600)
         self.gainPlot.Draw('ACP')
         c.SaveAs('gain.eps')'''
 
+    def FromParameters(A, B, errA, errB, dividerCurrent=np.linspace(600, 740, 15), correlation=0):
+        # gain curve with known parameters instead of a QC5 fit, e.g. for synthetic data
+        gainCurve = GainCurve.__new__(GainCurve)
+        gainCurve.A, gainCurve.B, gainCurve.errA, gainCurve.errB = A, B, errA, errB
+        gainCurve._covariance = np.array([[errA**2, correlation*errA*errB], [correlation*errA*errB, errB**2]])
+        gainCurve.errGain = None
+        gainCurve.dividerCurrent = np.asarray(dividerCurrent, dtype='float64')
+        gainCurve.gain = gainCurve.GetGain(gainCurve.dividerCurrent)
+        return gainCurve
+
+    @property
+    def gainPlot(self):
+        try: return self._gainPlot
+        except AttributeError: pass
+
+        if self.errGain is None: self._gainPlot = rt.TGraph(len(self.gain), self.dividerCurrent, self.gain)
+        else: self._gainPlot = rt.TGraphErrors(len(self.gain), self.dividerCurrent, self.gain, np.zeros_like(self.gain), self.errGain)
+        return self._gainPlot
+
+    @property
+    def covariance(self): # of A and B
+        return self._covariance
+
     def GetGain(self, dividerCurrent):
         return np.exp(self.A+dividerCurrent*self.B)
         #return self.gainPlotFit.Eval(dividerCurrent)
         #return self.gainPlot.Eval(dividerCurrent)
 
     def GetError(self, dividerCurrent):
-        return self.GetGain(dividerCurrent)*np.sqrt(self.errA**2+dividerCurrent**2*self.errB**2)
+        return self.GetGainAndError(dividerCurrent)[1]
         #return self.gainPlotFit.Eval(dividerCurrent)
         #return self.gainPlot.Eval(dividerCurrent)
 
+    def GetGainAndError(self, dividerCurrent):
+        # both at once for batches of divider currents (e.g. scans), with a single exponential;
+        # A and B are strongly anti-correlated, so the covariance term matters
+        (varA, covAB), (_, varB) = self._covariance
+        gain = self.GetGain(dividerCurrent)
+        return gain, gain*np.sqrt(varA+dividerCurrent*(2*covAB+dividerCurrent*varB))
+
+def releaseGraphs(plot):
+    # a TMultiGraph deletes its graphs when it is deleted: detach them first when they are kept elsewhere
+    graphs = plot.GetListOfGraphs() if hasattr(plot, 'GetListOfGraphs') else None
+    if graphs: graphs.Clear('nodelete')
+
+# quantities cached by DataTaking, with the settings and quantities each of them is computed from:
+dependencies = dict()
+
+def cachedQuantity(*inputs):
+    # property computed on first access and kept in the cache until one of its inputs changes
+    def decorator(compute):
+        quantity = compute.__name__
+        dependencies[quantity] = inputs
+        def getter(self):
+            try: return self.cache[quantity]
+            except KeyError: pass
+            self.cache[quantity] = compute(self)
+            return self.cache[quantity]
+        return property(getter)
+    return decorator
+
+def setting(name):
+    # attribute invalidating the cached quantities that depend on it when changed
+    def getter(self): return getattr(self, f'_{name}')
+    def setter(self, value):
+        try: changed = bool(getattr(self, f'_{name}')!=value)
+        except AttributeError: changed = True
+        setattr(self, f'_{name}', value)
+        if changed: self.Invalidate(name)
+    return property(getter, setter)
+
 class DataTaking:
-    # parse single data-taking at fixed distance
+    # parse single data-taking at fixed distance: the measured currents are kept as rows of one float64 array,
+    # derived quantities and plots in a cache from which they are dropped when an input changes
+
+    __slots__ = ['name', 'columns', 'cache', '_gainCurve', '_chamberDividerCurrent', '_linearizationMethod', '_fitBackend', '_collimatorRadius', '_breakpoint']
+    gainCurve = setting('gainCurve')
+    chamberDividerCurrent = setting('chamberDividerCurrent')
+    linearizationMethod = setting('linearizationMethod') # saturation, firstpoints, saturation2part, piecewiseSaturation
+    fitBackend = setting('fitBackend') # root (TF1 and Minuit) or scipy (numpy models, no ROOT)
+    collimatorRadius = setting('collimatorRadius') # in cm, None for the default spot area
+    breakpoint = setting('breakpoint') # xray current in uA where the anode current slope changes, None to detect it
+
+    def __init__(self, name, dataTakingDf, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation', fitBackend='root'):
+        # column names as in root files:
+        channels = ['XrayCurrent', 'ERRXrayCurrent', 'Ianode', 'ERRIanode']
+
+        # sort by xray currents in ascending order:
+        order = np.argsort(np.array(dataTakingDf[channels[0]]), kind='quicksort')
+        self.columns = np.array([ np.asarray(dataTakingDf[channel], dtype='float64')[order] for channel in channels ])
+        self.columns[2] = abs(self.columns[2])
 
-    def __init__(self, name, dataTakingDf, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation'):
-        # set column names as in root and excel files:
-        channelXrayCurrent = 'XrayCurrent'
-        channelXrayCurrentError = 'ERRXrayCurrent'
-        channelAnodeCurrent = 'Ianode'
-        channelAnodeCurrentError = 'ERRIanode'
-        
-        # sort dataframe by xray currents in ascending order:
-        dataTakingDf.sort_values(channelXrayCurrent, inplace=True)
-
-        xrayCurrent, errXrayCurrent = np.array(dataTakingDf[channelXrayCurrent]), np.array(dataTakingDf[channelXrayCurrentError])
-        anodeCurrent, errAnodeCurrent = abs(np.array(dataTakingDf[channelAnodeCurrent])), np.array(dataTakingDf[channelAnodeCurrentError])
-        
         self.name = name
-        '''self.measurement = {
-            'xray': [xrayCurrent, errXrayCurrent],
-            'anode': [anodeCurrent, errAnodeCurrent]
-        }'''
-        self._xrayCurrent, self._errXrayCurrent = xrayCurrent, errXrayCurrent
-        self._anodeCurrent, self._errAnodeCurrent = anodeCurrent, errAnodeCurrent
-        self.gainCurve = gainCurve
-        self.chamberDividerCurrent = chamberDividerCurrent
-        self.linearizationMethod = linearizationMethod # saturation, firstpoints, saturation2part
-        #self.chamberGain = gainCurve.GetGain(chamberDividerCurrent)
-
-    def FromExcelFile(name, inputFile, gainCurve, chamberDividerCurrent):
-        rootFile = rt.TFile(inputFile, 'READ')
-        dataTakingDf = pd.read_excel(inputFile, sheet_name='XRay-off-substracted')
-        return DataTaking(name, dataTakingDf, gainCurve, chamberDividerCurrent)
+        self.cache = dict()
+        self._gainCurve = gainCurve
+        self._chamberDividerCurrent = chamberDividerCurrent
+        self._linearizationMethod = linearizationMethod
+        self._fitBackend = fitBackend
+        self._collimatorRadius = None
+        self._breakpoint = scipyfit.defaultBreakpoint
+
+    def FromExcelFile(name, inputFile, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation', fitBackend='root'):
+        dataTakingDf = excelcache.readExcel(inputFile, sheet_name='XRay-off-substracted')
+        dataTakingDf.columns = [ setpoints.branchName(column) for column in dataTakingDf.columns ] # as in root files
+        return DataTaking(name, dataTakingDf, gainCurve, chamberDividerCurrent, linearizationMethod, fitBackend)
 
         '''channelXrayCurrent = 'XrayCurrent'
         channelXrayCurrentError = 'ERR XrayCurrent'
@@ -76,212 +230,361 @@ class DataTaking:
         anodeCurrent, errAnodeCurrent = abs(np.array(df[channelAnodeCurrent])), np.array(df[channelAnodeCurrentError])'''
 
 
+    def FromTree(name, tree, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation', fitBackend='root'):
+        data, cols = tree.AsMatrix(return_labels=True)
+        dataTakingDf = pd.DataFrame(data=data, columns=cols)
+        return DataTaking(name, dataTakingDf, gainCurve, chamberDividerCurrent, linearizationMethod, fitBackend)
+
+    def FromFile(file, treeName, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation', fitBackend='root', chunkSize=None, resolution=setpoints.defaultResolution):
+        # with chunkSize, the tree is streamed and averaged per xray current setpoint (within resolution uA) instead of loaded at once
+        with profiling.Stage('DataTaking.FromFile', name=treeName):
+            if chunkSize: return DataTaking.FromTreeStreaming(treeName, file, treeName, gainCurve, chamberDividerCurrent, linearizationMethod, fitBackend, chunkSize, resolution)
+            rootFile = rt.TFile(file, 'READ')
+            return DataTaking.FromTree(treeName, rootFile.Get(treeName), gainCurve, chamberDividerCurrent, linearizationMethod, fitBackend)
+
+    def FromTreeStreaming(name, file, treeName, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation', fitBackend='root', chunkSize=100000, resolution=setpoints.defaultResolution):
+        # average long current logs per xray current setpoint while reading, with bounded memory
+        accumulator = setpoints.SetpointAccumulator(resolution)
+        for chunk in iterateTree(file, treeName, setpoints.columnNames, chunkSize):
+            accumulator.Update(*[ chunk[column] for column in setpoints.columnNames ])
+        return DataTaking(name, accumulator.Result(), gainCurve, chamberDividerCurrent, linearizationMethod, fitBackend)
+
+    def FromResults(name, results, gainCurve, chamberDividerCurrent, linearizationMethod='piecewiseSaturation', fitBackend='root', breakpoint=scipyfit.defaultBreakpoint):
+        # rebuild a data-taking from the arrays returned by a worker process or saved by SaveResults, without refitting;
+        # breakpoint is the setting the results were obtained with, as changing it afterwards would drop them
+        dataTakingDf = pd.DataFrame({
+            'XrayCurrent': results['xray'], 'ERRXrayCurrent': results['errXray'],
+            'Ianode': results['anode'], 'ERRIanode': results['errAnode']
+        })
+        dataTaking = DataTaking(name, dataTakingDf, gainCurve, chamberDividerCurrent, linearizationMethod, fitBackend)
+        dataTaking._breakpoint = breakpoint
+        dataTaking.cache.update({
+            'anodeCurrentLinearized': (results['linearized'], results['errLinearized']),
+            'rate': (results['rate'], results['errRate']),
+            'flux': (results['flux'], results['errFlux']),
+            'effectiveGain': (results['effectiveGain'], results['errEffectiveGain'])
+        })
+        # fit results, absent from results saved by earlier versions, in which case they are refitted when needed:
+        fitResults = dict()
+        for key,values in results.items():
+            match = re.fullmatch(r'fit_(\w+)_(parameters|errors|covariance)', key)
+            if match: fitResults.setdefault(match.group(1), dict())[match.group(2)] = np.asarray(values, dtype='float64')
+        if fitResults:
+            dataTaking.cache['fitResults'] = fitResults
+            dataTaking.cache['xrayCurrentBreakpoint'] = float(results['breakpoint'])
+        return dataTaking
+
+    @property
+    def results(self):
+        # plain numpy arrays of all derived quantities and of the fit results, safe to pickle across processes
+        xray, errXray = self.xrayCurrent
+        anode, errAnode = self.anodeCurrent
+        linearized, errLinearized = self.anodeCurrentLinearized
+        rate, errRate = self.rate
+        flux, errFlux = self.flux
+        effectiveGain, errEffectiveGain = self.effectiveGain
+        results = {
+            'xray': xray, 'errXray': errXray,
+            'anode': anode, 'errAnode': errAnode,
+            'linearized': linearized, 'errLinearized': errLinearized,
+            'rate': rate, 'errRate': errRate,
+            'flux': flux, 'errFlux': errFlux,
+            'effectiveGain': effectiveGain, 'errEffectiveGain': errEffectiveGain
+        }
+        if 'fitResults' in self.cache: # not refitted for data-takings rebuilt from results without them
+            results['breakpoint'] = np.float64(self.xrayCurrentBreakpoint)
+            for fitName,fitResult in self.fitResults.items():
+                for quantity,values in fitResult.items(): results[f'fit_{fitName}_{quantity}'] = np.asarray(values, dtype='float64')
+        return results
+
+    def Invalidate(self, changed):
+        # drop from the cache everything computed, directly or not, from the changed setting or quantity
+        stale = {changed}
+        while True:
+            newlyStale = { quantity for quantity,inputs in dependencies.items() if quantity not in stale and stale.intersection(inputs) }
+            if not newlyStale: break
+            stale |= newlyStale
+        for quantity in stale: releaseGraphs(self.cache.pop(quantity, None)) # e.g. currentPlot holds the cached anodePlot
+
     def SetCollimator(self, radius):
         self.collimatorRadius = radius
 
     def SetLinearizeMethod(self, method):
         self.linearizationMethod = method
 
-    @property
+    @cachedQuantity('breakpoint')
+    def xrayCurrentBreakpoint(self):
+        if self.breakpoint is not None: return self.breakpoint
+        return scipyfit.DetectBreakpoint(self.xrayCurrent[0], *self.anodeCurrent)
+
+    def SetFitResults(self, fitResults):
+        # use fit results obtained elsewhere, e.g. from a joint fit, instead of fitting this data-taking alone
+        self.Invalidate('fitResults')
+        self.cache['fitResults'] = fitResults
+
+    @cachedQuantity('gainCurve', 'chamberDividerCurrent')
     def nominalGain(self):
-        try: return self._nominalGain
-        except AttributeError: pass
-        self._nominalGain = self.gainCurve.GetGain(self.chamberDividerCurrent)
-        return self._nominalGain
+        return self.gainCurve.GetGain(self.chamberDividerCurrent)
 
     @property
     def xrayCurrent(self):
-        #return self.measurement['xray'][0], self.measurement['xray'][1]
-        return self._xrayCurrent, self._errXrayCurrent
+        return self.columns[0], self.columns[1]
 
     @property
     def anodeCurrent(self):
-        return self._anodeCurrent, self._errAnodeCurrent
+        return self.columns[2], self.columns[3]
 
-    @property
-    def anodeCurrentLinearized(self):
-        try: return self._anodeCurrentLinearized, self._errAnodeCurrentLinearized
-        except AttributeError: pass
-        
+    def FitAnodePlot(self, fit, label=None):
+        # fit the anode current graph in the function range, timing the fit and recording its status
+        with profiling.Stage(f'Fit {label or fit.GetName()}', name=self.name, method=self.linearizationMethod):
+            return getFitResult(fit, self.anodePlot.Fit(fit, 'RS'))
+
+    @profiling.Timed
+    def FitAnodeCurrent(self):
+        # run the fits needed by the linearization method with the selected backend,
+        # return dict fit name -> { parameters, errors, covariance }
         xray, errXray = self.xrayCurrent
-        anodeCurrent, errAnodeCurrent = self.anodeCurrent
-        anodeCurrentPlot = self.anodePlot
+        anode, errAnode = self.anodeCurrent
+        breakpoint = self.xrayCurrentBreakpoint
+        if self.fitBackend=='scipy': return scipyfit.FitAnodeCurrent(xray, errXray, anode, errAnode, self.linearizationMethod, breakpoint)
+        elif self.fitBackend!='root': raise ValueError('Unrecognized fit backend')
+        fitResults = dict()
         if self.linearizationMethod=='saturation':
-            fit = rt.TF1('p', '([0]*x+[1])/(1+([0]*x+[1])*[2])', 0, 200) # fit as (A+Bx)/(1+tau(A+Bx))
+            fit = fitmodels.Model('p', saturationFormula, 0, 200) # fit as (A+Bx)/(1+tau(A+Bx))
+            A, B, t = scipyfit.SeedSaturation(xray, anode, errAnode, offset=False)
+            fit.SetParameters(A, 0, t)
             fit.FixParameter(1, 0)
+            fitResults['p'] = self.FitAnodePlot(fit)
         elif self.linearizationMethod=='firstpoints':
-            fit = rt.TF1('p', '[0]*x+[1]', 0, 30) # linear fit on first points
+            fit = fitmodels.Model('p', linearFormula, 0, 30) # linear fit on first points
+            fitResults['p'] = self.FitAnodePlot(fit)
         elif self.linearizationMethod=='saturation2part':
-            xrayCurrentMax = 99.2
             # fit as two saturating functions separately:
-            separationXrayCurrent = max(xray[xray<=100]) # divide x-ray currents in two sets at about 100
-            #separationAnodeCurrent = anodeCurrent[xray==separationXrayCurrent][0]
-            fit1 = rt.TF1('p1', '([0]*x+[1])/(1+([0]*x+[1])*[2])', 0.1, separationXrayCurrent)
+            separationXrayCurrent = scipyfit.separationXrayCurrent(xray, breakpoint) # divide x-ray currents in two sets at the breakpoint
+            upperXrayCurrent = scipyfit.upperXrayCurrent(xray, separationXrayCurrent)
+            lower, upper = (xray>=0.1)&(xray<=separationXrayCurrent), (xray>=upperXrayCurrent)&(xray<=200)
+            fit1 = fitmodels.Model('p1', saturationFormula, 0.1, separationXrayCurrent)
+            seeds1 = scipyfit.SeedSaturation(xray[lower], anode[lower], errAnode[lower], offset=False)
+            if seeds1: fit1.SetParameters(seeds1[0], 0, seeds1[2])
             fit1.FixParameter(1, 0)
-            fit2 = rt.TF1('p2', '([0]*(x-[3])+[1])/(1+([0]*(x-[3])+[1])*[2])+[4]', separationXrayCurrent+1, 200)
+            fit2 = fitmodels.Model('p2', shiftedSaturationFormula, upperXrayCurrent, 200)
+            fitResults['p1'] = self.FitAnodePlot(fit1)
+            offset2 = fit1.Eval(breakpoint)
+            seeds2 = scipyfit.SeedSaturation(xray[upper]-breakpoint, anode[upper]-offset2, errAnode[upper], offset=False)
+            if seeds2: fit2.SetParameters(seeds2[0], 0, seeds2[2])
             fit2.SetParameter(1, 0)
+            fit2.FixParameter(3, breakpoint)
+            fit2.FixParameter(4, offset2)
+            fitResults['p2'] = self.FitAnodePlot(fit2)
         elif self.linearizationMethod=='piecewiseSaturation':
             # fit as two saturating functions piecewise:
-
-            f1 = '([0]*x+[1])/(1+([0]*x+[1])*[2])*(x<[3])'
-            '''f2 = '+([0]*[3]+[1])/(1+([0]*[3]+[1])*[2])*(x>[3])'
-            f3 = '+([4]*(x-[3])+[5])/(1+([4]*(x-[3])+[5])*[6])*(x>[3])'''
-            f2 = '+([0]*[3]+[1]+[4]*(x-[3])+[5])/(1+([0]*[3]+[1])*[2]+([4]*(x-[3])+[5])*[6])*(x>[3])'
-            fit = rt.TF1('p1', f1+f2, 0, 200)
-            fit.SetParNames('A1', 'B1', 't1', 'x0', 'A2', 'B2', 't2')
-            
-            # get initial guess for parameters A and B from fit on restricted range:
-            print('Guessing initial parameters...')
-            fitPartial1 = rt.TF1('p1', '([0]*x+[1])/(1+([0]*x+[1])*[2])', 0, 100)
-            fitPartial2 = rt.TF1('p2', '([0]*x+[1])/(1+([0]*x+[1])*[2])', 100, 200)
-            anodeCurrentPlot.Fit(fitPartial1, 'R')
-            anodeCurrentPlot.Fit(fitPartial2, 'R')
-            A1, B1, t1 = fitPartial1.GetParameter(0), fitPartial1.GetParameter(1), fitPartial1.GetParameter(2)
-            A2, B2, t2 = fitPartial2.GetParameter(0), fitPartial2.GetParameter(1), fitPartial2.GetParameter(2)
-            fit.SetParameters(A1, B1, t1, 99, A2, B2, t2)
-            #fit.SetParameters(4e-9, 1e-8, 8e4, 99, 1e-9, 1e-8, 1e4)
-            fit.FixParameter(3, 99.2)
-            #fit.FixParameter(1, 0)
+            fit = fitmodels.Model('p1', piecewiseSaturationFormula, 0, 200, parameterNames[piecewiseSaturationFormula])
+            # initial parameters in closed form from the linearized model of each piece:
+            fit.SetParameters(*scipyfit.SeedPiecewiseSaturation(xray, anode, errAnode, breakpoint))
+            fit.FixParameter(3, breakpoint)
+            fitResults['p1'] = self.FitAnodePlot(fit)
         else: raise ValueError('Unrecognized current linearization method')
-
+        return fitResults
+
+    def FitFunction(self, fitName, fitResult, xmin, xmax):
+        # TF1 of a fit not done on anodePlot here, with the fit parameters and errors and the chi2 in its range;
+        # parameters without error were fixed in the fit
+        xray = self.xrayCurrent[0]
+        formula = fitModels[self.linearizationMethod][fitName][0]
+        fit = fitmodels.Model(fitName, formula, xmin, xmax, parameterNames.get(formula))
+        for ipar,(value,error) in enumerate(zip(fitResult['parameters'], fitResult['errors'])):
+            if error==0: fit.FixParameter(ipar, value)
+            else:
+                fit.SetParameter(ipar, value)
+                fit.SetParError(ipar, error)
+        npoints = int(np.sum((xray>=xmin)&(xray<=xmax)))
+        fit.SetChisquare(self.anodePlot.Chisquare(fit, 'R'))
+        fit.SetNumberFitPoints(npoints)
+        fit.SetNDF(npoints-int(np.count_nonzero(fitResult['errors'])))
+        return fit
+
+    def AttachFitFunctions(self):
+        # draw the linearization fits with the anode current also when they come from the fit cache, the scipy backend,
+        # a joint fit or a worker process, replacing functions left on the graph by an earlier fit with other parameters
+        fitResults = self.fitResults
+        limits = dict()
+        if self.linearizationMethod=='saturation2part':
+            separation = scipyfit.separationXrayCurrent(self.xrayCurrent[0], fitResults['p2']['parameters'][3])
+            limits = { 'separation': separation, 'upper': scipyfit.upperXrayCurrent(self.xrayCurrent[0], separation) }
+        functions = self.anodePlot.GetListOfFunctions()
+        for fitName,fitResult in fitResults.items():
+            attached = functions.FindObject(fitName)
+            if attached:
+                if np.array_equal([ attached.GetParameter(ipar) for ipar in range(attached.GetNpar()) ], fitResult['parameters']): continue
+                functions.Remove(attached)
+            xmin, xmax = fitModels[self.linearizationMethod][fitName][1:3]
+            functions.Add(self.FitFunction(fitName, fitResult, limits.get(xmin, xmin), limits.get(xmax, xmax)))
+
+    @cachedQuantity('linearizationMethod', 'fitBackend', 'xrayCurrentBreakpoint')
+    def fitResults(self):
+        xray, errXray = self.xrayCurrent
+        anodeCurrent, errAnodeCurrent = self.anodeCurrent
+        key = fitcache.fitKey(
+            [xray, errXray, anodeCurrent, errAnodeCurrent],
+            {
+                'method': self.linearizationMethod, 'models': fitModels.get(self.linearizationMethod), 'backend': self.fitBackend,
+                'breakpoint': self.xrayCurrentBreakpoint, 'seeding': 'closedForm'
+            }
+        )
+        fitResults = fitcache.load(key)
+        if fitResults is None:
+            fitResults = self.FitAnodeCurrent()
+            fitcache.save(key, fitResults)
+        return fitResults
+
+    @cachedQuantity('fitResults')
+    def anodeCurrentLinearized(self):
+        xray, errXray = self.xrayCurrent
+        fitResults = self.fitResults
+        parameters = { fitName: fitResult['parameters'] for fitName,fitResult in fitResults.items() }
+        anodeCurrentLinearized = linearizeCurrent(self.linearizationMethod, parameters, xray)
         if self.linearizationMethod in ['saturation', 'firstpoints']:
-            anodeCurrentPlot.Fit(fit, 'R')
-            A, B = fit.GetParameter(0), fit.GetParameter(1)
-            errA, errB = fit.GetParError(0), fit.GetParError(1)
-            self._anodeCurrentLinearized, self._errAnodeCurrentLinearized = A*xray+B, np.sqrt(errB**2 + (A*xray)**2*((errA/A)**2+(errXray/xray)**2))
+            (A, B), (errA, errB) = fitResults['p']['parameters'][:2], fitResults['p']['errors'][:2]
+            errAnodeCurrentLinearized = np.sqrt(errB**2 + (A*xray)**2*((errA/A)**2+(errXray/xray)**2))
         elif self.linearizationMethod=='saturation2part':
-            anodeCurrentPlot.Fit(fit1, 'R')
-            fit2.FixParameter(3, xrayCurrentMax)
-            fit2.FixParameter(4, fit1.Eval(xrayCurrentMax))
-            anodeCurrentPlot.Fit(fit2, 'R')
-            A1, B1, A2, B2 = fit1.GetParameter(0), fit1.GetParameter(1), fit2.GetParameter(0), fit2.GetParameter(1)
-            errA1, errB1, errA2, errB2 = fit1.GetParError(0), fit1.GetParError(1), fit2.GetParError(0), fit2.GetParError(1)
+            separationXrayCurrent = scipyfit.separationXrayCurrent(xray, fitResults['p2']['parameters'][3])
+            parameters1, parameters2 = fitResults['p1']['parameters'], fitResults['p2']['parameters']
+            errors1, errors2 = fitResults['p1']['errors'], fitResults['p2']['errors']
+            A1, B1, A2, B2 = parameters1[0], parameters1[1], parameters2[0], parameters2[1]
+            errA1, errB1, errA2, errB2 = errors1[0], errors1[1], errors2[0], errors2[1]
             xray1, errXray1 = xray[xray<=separationXrayCurrent], errXray[xray<=separationXrayCurrent]
             xray2, errXray2 = xray[xray>separationXrayCurrent], errXray[xray>separationXrayCurrent]
-            linearized1, errLinearized1 = A1*xray1+B1, np.sqrt(errB1**2 + (A1*xray1)**2*((errA1/A1)**2+(errXray1/xray1)**2))
-            #shift2, offset2 = fit2.GetParameter(3), A1*xrayCurrentMax+B1
-            shift2, offset2 = fit2.GetParameter(3), fit2.GetParameter(4)
-            linearized2, errLinearized2 = offset2 + A2*(xray2-shift2)+B2, np.sqrt(errB2**2 + (A2*xray2)**2*((errA2/A2)**2+(errXray2/xray2)**2))
-            self._anodeCurrentLinearized = np.concatenate([linearized1, linearized2])
-            self._errAnodeCurrentLinearized = np.concatenate([errLinearized1, errLinearized2])
+            errLinearized1 = np.sqrt(errB1**2 + (A1*xray1)**2*((errA1/A1)**2+(errXray1/xray1)**2))
+            errLinearized2 = np.sqrt(errB2**2 + (A2*xray2)**2*((errA2/A2)**2+(errXray2/xray2)**2))
+            errAnodeCurrentLinearized = np.concatenate([errLinearized1, errLinearized2])
         elif self.linearizationMethod=='piecewiseSaturation':
-            print('Fitting with saturating function...')
-            anodeCurrentPlot.Fit(fit, 'R')
-            A1, B1, x0, A2, B2,  = fit.GetParameter(0), fit.GetParameter(1), fit.GetParameter(3), fit.GetParameter(4), fit.GetParameter(5)
-            errA1, errB1, errX0, errA2, errB2 = fit.GetParError(0), fit.GetParError(1), fit.GetParError(3), fit.GetParError(4), fit.GetParError(5)
-            self._anodeCurrentLinearized = (A1*xray+B1)*(xray<=x0) + (A1*x0+B1 + A2*(xray-x0)+B2)*(xray>x0)
-            self._errAnodeCurrentLinearized = np.sqrt(errA1**2*errXray**2+errB1**2)*(xray<=x0) + np.sqrt(errA1**2*errX0**2+B1**2 + errA2**2*(errXray**2+errX0**2)+errB2**2)*(xray>x0)
-            #self._errAnodeCurrentLinearized = np.sqrt(errB1**2 + (A1*xray)**2*((errA1/A1)**2+(errXray/xray)**2))
-        return self._anodeCurrentLinearized, self._errAnodeCurrentLinearized
-
-    @property
+            parameters, errors = fitResults['p1']['parameters'], fitResults['p1']['errors']
+            A1, B1, x0, A2, B2,  = parameters[0], parameters[1], parameters[3], parameters[4], parameters[5]
+            errA1, errB1, errX0, errA2, errB2 = errors[0], errors[1], errors[3], errors[4], errors[5]
+            errAnodeCurrentLinearized = np.sqrt(errA1**2*errXray**2+errB1**2)*(xray<=x0) + np.sqrt(errA1**2*errX0**2+errB1**2 + errA2**2*(errXray**2+errX0**2)+errB2**2)*(xray>x0)
+            #errAnodeCurrentLinearized = np.sqrt(errB1**2 + (A1*xray)**2*((errA1/A1)**2+(errXray/xray)**2))
+        return anodeCurrentLinearized, errAnodeCurrentLinearized
+
+    @cachedQuantity('anodeCurrentLinearized', 'gainCurve', 'chamberDividerCurrent')
     def rate(self): # hit rate on chamber in Hz
-        try: return self._rate, self._errRate
-        except AttributeError: pass
-
         anodeCurrent, errAnodeCurrent = self.anodeCurrentLinearized
-        nominalGain, errNominalGain = self.gainCurve.GetGain(self.chamberDividerCurrent), self.gainCurve.GetError(self.chamberDividerCurrent)
-        self._rate = anodeCurrent/(qe*primaries*nominalGain)
-        self._errRate = self._rate * np.sqrt((errAnodeCurrent/anodeCurrent)**2 + (errNominalGain/nominalGain)**2)
-        return self._rate, self._errRate
+        nominalGain, errNominalGain = self.gainCurve.GetGainAndError(self.chamberDividerCurrent)
+        return computeRate(anodeCurrent, errAnodeCurrent, nominalGain, errNominalGain)
 
     @property
-    def flux(self): # flux on chamber in Hz/cm2
-        try: return self._flux, self._errFlux
-        except AttributeError: pass
+    def spotArea(self): # irradiated area in cm2
+        if self.collimatorRadius is None: return 10*10
+        return np.pi*self.collimatorRadius**2
 
-        try: spotArea = np.pi*self.collimatorRadius**2
-        except AttributeError: spotArea = 10*10
+    @cachedQuantity('rate', 'collimatorRadius')
+    def flux(self): # flux on chamber in Hz/cm2
+        spotArea = self.spotArea
         rate, errRate = self.rate
-        self._flux, self._errFlux = rate/spotArea, errRate/spotArea
-        return self._flux, self._errFlux
+        return rate/spotArea, errRate/spotArea
 
-    @property
+    @cachedQuantity('rate')
     def effectiveGain(self):
-        try: return self._effectiveGain, self._errEffectiveGain
-        except AttributeError: pass
-
         anodeCurrent, errAnodeCurrent = self.anodeCurrent
         rate, errRate = self.rate
-        self._effectiveGain = anodeCurrent/(qe*primaries*rate)
-        self._errEffectiveGain = self._effectiveGain * ((errAnodeCurrent/anodeCurrent)**2+(errRate/rate)**2)**0.5
-        return self._effectiveGain, self._errEffectiveGain
+        return computeEffectiveGain(anodeCurrent, errAnodeCurrent, rate, errRate)
 
-    @property
+    def Scan(self, dividerCurrents):
+        # derived quantities for every (divider current, xray current) pair as 2D arrays,
+        # reusing the same linearization fit for all divider currents
+        dividerCurrents = np.asarray(dividerCurrents, dtype='float64')[:,None]
+        anodeCurrent, errAnodeCurrent = self.anodeCurrent
+        linearized, errLinearized = self.anodeCurrentLinearized
+        gain, errGain = self.gainCurve.GetGainAndError(dividerCurrents)
+        rate, errRate = computeRate(linearized, errLinearized, gain, errGain)
+        effectiveGain, errEffectiveGain = computeEffectiveGain(anodeCurrent, errAnodeCurrent, rate, errRate)
+        return {
+            'dividerCurrent': dividerCurrents[:,0], 'xray': self.xrayCurrent[0],
+            'gain': gain[:,0], 'errGain': errGain[:,0],
+            'rate': rate, 'errRate': errRate,
+            'flux': rate/self.spotArea, 'errFlux': errRate/self.spotArea,
+            'effectiveGain': effectiveGain, 'errEffectiveGain': errEffectiveGain
+        }
+
+    @cachedQuantity()
     def anodePlot(self):
-        try: return self._anodePlot
-        except AttributeError: pass
-
         xray, errXray = self.xrayCurrent
         anode, errAnode = self.anodeCurrent
-        self._anodePlot = rt.TGraphErrors(len(xray), xray, abs(anode), errXray, errAnode)
-        self._anodePlot.SetName('AnodePlot')
-        self._anodePlot.SetTitle(';X-ray current (#muA);Anode current (A)')
-        return self._anodePlot
+        anodePlot = rt.TGraphErrors(len(xray), xray, abs(anode), errXray, errAnode)
+        anodePlot.SetName('AnodePlot')
+        anodePlot.SetTitle(';X-ray current (#muA);Anode current (A)')
+        return anodePlot
 
-    @property
+    @cachedQuantity('anodeCurrentLinearized')
     def anodePlotLinearized(self):
-        try: return self._anodePlotLinearized
-        except AttributeError: pass
-
         xray, errXray = self.xrayCurrent
         linearized, errLinearized = self.anodeCurrentLinearized
-        self._anodePlotLinearized = rt.TGraphErrors(len(xray), xray, linearized, errXray, errLinearized)
-        self._anodePlotLinearized.SetName('AnodePlotLinearized')
-        self._anodePlotLinearized.SetTitle(';X-ray current (#muA);Anode current (A)')
-        self._anodePlotLinearized.SetMarkerStyle(5)
-        return self._anodePlotLinearized
+        anodePlotLinearized = rt.TGraphErrors(len(xray), xray, linearized, errXray, errLinearized)
+        anodePlotLinearized.SetName('AnodePlotLinearized')
+        anodePlotLinearized.SetTitle(';X-ray current (#muA);Anode current (A)')
+        anodePlotLinearized.SetMarkerStyle(5)
+        return anodePlotLinearized
 
-    @property
+    @cachedQuantity('rate')
     def ratePlot(self):
-        try: return self._ratePlot
-        except AttributeError: pass
-
         xray, errXray = self.xrayCurrent
         rate, errRate = self.rate
-        self._ratePlot = rt.TGraphErrors(len(xray), xray, rate/1e3, errXray, errRate/1e3)
-        self._ratePlot.SetName('RatePlot')
-        self._ratePlot.SetTitle(';X-ray current (#muA);Rate (kHz)')
-        return self._ratePlot
+        ratePlot = rt.TGraphErrors(len(xray), xray, rate/1e3, errXray, errRate/1e3)
+        ratePlot.SetName('RatePlot')
+        ratePlot.SetTitle(';X-ray current (#muA);Rate (kHz)')
+        return ratePlot
 
-    @property
+    @cachedQuantity('effectiveGain')
     def effectiveGainPlot(self):
-        try: return self._effectiveGainPlot
-        except AttributeError: pass
-
         xray, errXray = self.xrayCurrent
         effectiveGain, errEffectiveGain = self.effectiveGain
-        self._effectiveGainPlot = rt.TGraphErrors(len(xray), xray, effectiveGain/1e3, errXray, errEffectiveGain/1e3)
-        self._effectiveGainPlot.SetName('EffectiveGainPlot')
-        self._effectiveGainPlot.SetTitle(';X-ray current (#muA);Effective gain (#times 10^{4})')
-        return self._effectiveGainPlot
+        effectiveGainPlot = rt.TGraphErrors(len(xray), xray, effectiveGain/1e3, errXray, errEffectiveGain/1e3)
+        effectiveGainPlot.SetName('EffectiveGainPlot')
+        effectiveGainPlot.SetTitle(';X-ray current (#muA);Effective gain (#times 10^{4})')
+        return effectiveGainPlot
 
-    @property
+    @cachedQuantity('flux', 'effectiveGain')
     def rateCapabilityPlot(self):
-        try: return self._rateCapabilityPlot
-        except AttributeError: pass
-
         flux, errFlux = self.flux
         effectiveGain, errEffectiveGain = self.effectiveGain
-        self._rateCapabilityPlot = rt.TGraphErrors(len(flux), flux/1e3, effectiveGain/1e3, errFlux/1e3, errEffectiveGain/1e3)
-        self._rateCapabilityPlot.SetName('RateCapabilityPlot')
-        self._rateCapabilityPlot.SetTitle(';Rate (kHz/cm^{2});Effective gain (#times 10^{4})')
-        return self._rateCapabilityPlot
-
+        rateCapabilityPlot = rt.TGraphErrors(len(flux), flux/1e3, effectiveGain/1e3, errFlux/1e3, errEffectiveGain/1e3)
+        rateCapabilityPlot.SetName('RateCapabilityPlot')
+        rateCapabilityPlot.SetTitle(';Rate (kHz/cm^{2});Effective gain (#times 10^{4})')
+        return rateCapabilityPlot
+
+    @cachedQuantity('anodePlot', 'anodePlotLinearized')
+    def currentPlot(self):
+        anodePlotLinearized = self.anodePlotLinearized # fits anodePlot, unless the fit results are already known
+        self.AttachFitFunctions()
+        currentPlot = rt.TMultiGraph()
+        currentPlot.SetTitle(';X-ray current (#muA);Anode current (A)')
+        currentPlot.Add(self.anodePlot, 'p')
+        currentPlot.Add(anodePlotLinearized, 'p')
+        return currentPlot
+
+    @profiling.Timed
+    def SaveResults(self, path):
+        np.savez(path, **self.results)
+
+    def QueuePlots(self, renderQueue, path):
+        # same plots as the Save* methods, rendered later in one pass
+        renderQueue.Add(f'{path}_AnodeCurrent', self.name, self.currentPlot, 'a', [self.anodePlot, self.anodePlotLinearized])
+        renderQueue.Add(f'{path}_Rate', self.name, self.ratePlot, 'ap')
+        renderQueue.Add(f'{path}_EffectiveGain', self.name, self.effectiveGainPlot, 'ap')
+        renderQueue.Add(f'{path}_RateCapability', self.name, self.rateCapabilityPlot, 'ap', logx=True)
+
+    @profiling.Timed
     def SaveCurrents(self, epsPath, rootPath):
+        currentPlot = self.currentPlot # with the fit functions attached to anodePlot
         rootFile = rt.TFile(rootPath, 'RECREATE')
         self.anodePlot.Write()
         self.anodePlotLinearized.Write()
         rootFile.Close()
 
         currentCanvas = rt.TCanvas('CurrentCanvas', '', 600, 600)
-        currentMultiGraph = rt.TMultiGraph()
-        currentMultiGraph.SetTitle(';X-ray current (#muA);Anode current (A)')
-        currentMultiGraph.Add(self.anodePlot, 'p')
-        currentMultiGraph.Add(self.anodePlotLinearized, 'p')
-        currentMultiGraph.Draw('a')
+        currentPlot.Draw('a')
         currentCanvas.SaveAs(epsPath)
 
+    @profiling.Timed
     def SaveRate(self, epsPath, rootPath):
         ratePlot = self.ratePlot
         ratePlot.SaveAs(rootPath)
@@ -289,6 +592,7 @@ class DataTaking:
         ratePlot.Draw('ap')
         rateCanvas.SaveAs(epsPath)
 
+    @profiling.Timed
     def SaveEffectiveGain(self, epsPath, rootPath):
         effectiveGainPlot = self.effectiveGainPlot
         effectiveGainPlot.SaveAs(rootPath)
@@ -296,6 +600,7 @@ class DataTaking:
         effectiveGainPlot.Draw('ap')
         gainCanvas.SaveAs(epsPath)
 
+    @profiling.Timed
     def SaveRateCapability(self, epsPath, rootPath):
         rateCapabilityPlot = self.rateCapabilityPlot
         rateCapabilityPlot.SaveAs(rootPath)
@@ -311,30 +616,76 @@ class Measurement:
     def __init__(self, dataTakingList):
         self.dataTakingList = dataTakingList
 
-    def FromFile(file, gainCurve, dividerCurrent, linearizationMethod='saturation2part'):
-        rootFile = rt.TFile(file, 'READ')
+    @profiling.Timed
+    def FromFile(file, gainCurve, dividerCurrent, linearizationMethod='saturation2part', fitBackend='root', chunkSize=None, resolution=setpoints.defaultResolution):
         dataTakingList = list()
-        for treeKey in rootFile.GetListOfKeys():
-            treeName = treeKey.GetName()
-            tree = rootFile.Get(treeName)
-            data, cols = tree.AsMatrix(return_labels=True)
-            measurementDf = pd.DataFrame(data=data, columns=cols)
-            dataTakingList.append(DataTaking(treeName, measurementDf, gainCurve, dividerCurrent, linearizationMethod))
+        for treeName in Measurement.TreeNames(file):
+            dataTakingList.append(DataTaking.FromFile(file, treeName, gainCurve, dividerCurrent, linearizationMethod, fitBackend, chunkSize, resolution))
         return Measurement(dataTakingList)
 
+    def SetBreakpoint(self, breakpoint):
+        for dataTaking in self: dataTaking.breakpoint = breakpoint
+
+    def FitJoint(self, shared=[2, 6], fixed=None):
+        # fit the piecewise saturating model to all data-takings at once, with parameters in shared (by default
+        # the time constants t1 and t2) common to all and slopes and offsets per data-taking; the result replaces
+        # the separate fit of each data-taking. Always uses the scipy backend.
+        # By default the breakpoint is fixed, to the median of the breakpoints of the data-takings
+        for dataTaking in self:
+            if dataTaking.linearizationMethod!='piecewiseSaturation': raise ValueError('Joint fit only implemented for piecewiseSaturation')
+        dataTakings = list({ dataTaking.name: dataTaking for dataTaking in self }.values()) # each tree weighs once on the shared parameters
+        if fixed is None: fixed = { 3: float(np.median([ dataTaking.xrayCurrentBreakpoint for dataTaking in dataTakings ])) }
+        datasets = [ (*dataTaking.xrayCurrent, *dataTaking.anodeCurrent) for dataTaking in dataTakings ]
+        key = fitcache.fitKey(
+            [ array for dataset in datasets for array in dataset ],
+            { 'method': 'joint', 'models': fitModels['piecewiseSaturation']['p1'][0], 'shared': shared, 'fixed': fixed, 'backend': 'scipy' }
+        )
+        names = [ dataTaking.name for dataTaking in dataTakings ]
+        fitResults = fitcache.load(key)
+        if fitResults is None or set(fitResults)!=set(names):
+            fitResults = dict(zip(names, scipyfit.FitJointPiecewiseSaturation(datasets, shared, fixed)))
+            fitcache.save(key, fitResults)
+        for dataTaking in self: dataTaking.SetFitResults({ 'p1': fitResults[dataTaking.name] })
+        return fitResults
+
+    def TreeNames(file):
+        rootFile = rt.TFile(file, 'READ')
+        # a tree written more than once is listed once per cycle, keep each name once in file order:
+        treeNames = list(dict.fromkeys( treeKey.GetName() for treeKey in rootFile.GetListOfKeys() ))
+        rootFile.Close()
+        return treeNames
+
     def __iter__(self): return self.dataTakingList.__iter__()
 
+    def Scan(self, dividerCurrents):
+        return { dataTaking.name: dataTaking.Scan(dividerCurrents) for dataTaking in self }
+
     @property
     def rateCapabilityPlot(self):
-        try: return self._rateCapabilityPlot
+        # rebuilt when the plot of a data-taking was recomputed, e.g. after a change of its settings
+        graphs = [ dataTaking.rateCapabilityPlot for dataTaking in self ]
+        try:
+            if len(graphs)==len(self._graphs) and all(graph is old for graph,old in zip(graphs, self._graphs)): return self._rateCapabilityPlot
         except AttributeError: pass
+        self.Release()
 
         self._rateCapabilityPlot = rt.TMultiGraph()
         self._rateCapabilityPlot.SetName('RateCapabilityPlot')
         self._rateCapabilityPlot.SetTitle('Rate capability;Rate (kHz/cm^{2});Effective gain (#times 10^{4})')
-        for dataTaking in self: self._rateCapabilityPlot.Add(dataTaking.rateCapabilityPlot, 'p')
+        for graph in graphs: self._rateCapabilityPlot.Add(graph, 'p')
+        self._graphs = graphs
         return self._rateCapabilityPlot
 
+    def Release(self):
+        # drop the combined plot without deleting the graphs, which belong to the data-takings
+        try: releaseGraphs(self._rateCapabilityPlot)
+        except AttributeError: return
+        del self._rateCapabilityPlot, self._graphs
+
+    def QueuePlots(self, renderQueue, path):
+        renderQueue.Add(path, '', self.rateCapabilityPlot, 'a', logx=True)
+
+    @profiling.Timed
     def SaveRateCapability(self, epsPath, rootPath):
         rateCapabilityPlot = self.rateCapabilityPlot
         rateCapabilityPlot.SaveAs(rootPath)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+import setpoints
+import excelcache
+
+# reduction of raw picoammeter logs to the XRay-off-substracted layout: the log is split in plateaus
+# of constant xray current, the dark current of the xray-off plateaus around each xray-on plateau
+# is subtracted and the plateaus are averaged per setpoint
+
+def findPlateaus(xrayCurrent, resolution):
+    # run-length encoding of the xray current quantized to the setpoint resolution,
+    # returns plateau index of each sample and quantized setpoint of each plateau
+    quantized = np.round(xrayCurrent/resolution)*resolution
+    changes = np.flatnonzero(np.diff(quantized)!=0)+1
+    plateau = np.zeros(len(quantized), dtype='int64')
+    plateau[changes] = 1
+    plateau = np.cumsum(plateau)
+    return plateau, quantized[np.concatenate([[0], changes])]
+
+def plateauMeans(plateau, nplateaus, values, weights):
+    # mean and standard error of the mean of values per plateau, only counting samples with weight 1
+    n = np.bincount(plateau, weights=weights, minlength=nplateaus)
+    with np.errstate(invalid='ignore', divide='ignore'): # plateaus shorter than the settling time
+        mean = np.bincount(plateau, weights=values*weights, minlength=nplateaus)/n
+        variance = np.bincount(plateau, weights=values**2*weights, minlength=nplateaus)/n-mean**2
+    return mean, np.sqrt(np.clip(variance, 0, None)/np.where(n>1, n, np.inf))
+
+def SubtractXrayOff(time, xrayCurrent, anodeCurrent, offThreshold=0.05, resolution=0.1, settlingTime=0.):
+    # time in s, xray current in uA, anode current in A; samples within settlingTime
+    # from the start of a plateau are dropped as transients
+    order = np.argsort(time, kind='stable')
+    time, xrayCurrent, anodeCurrent = [ np.asarray(array, dtype='float64')[order] for array in [time, xrayCurrent, anodeCurrent] ]
+    xrayCurrent = np.where(xrayCurrent>offThreshold, xrayCurrent, 0) # snap xray-off noise to zero
+
+    plateau, plateauSetpoint = findPlateaus(xrayCurrent, resolution)
+    nplateaus = len(plateauSetpoint)
+    plateauStart = time[np.searchsorted(plateau, np.arange(nplateaus))]
+    settled = (time-plateauStart[plateau]>=settlingTime).astype('float64')
+
+    xrayMean, errXrayMean = plateauMeans(plateau, nplateaus, xrayCurrent, settled)
+    anodeMean, errAnodeMean = plateauMeans(plateau, nplateaus, anodeCurrent, settled)
+    valid = np.isfinite(anodeMean)
+    isOff = (plateauSetpoint==0)&valid
+    isOn = (plateauSetpoint>0)&valid
+
+    # dark current of each xray-on plateau, averaged over the closest xray-off plateaus before and after:
+    offIndices, onIndices = np.flatnonzero(isOff), np.flatnonzero(isOn)
+    if len(offIndices)==0: raise ValueError('No xray-off plateau found in the current log')
+    after = np.searchsorted(offIndices, onIndices)
+    before = offIndices[np.clip(after-1, 0, len(offIndices)-1)]
+    after = offIndices[np.clip(after, 0, len(offIndices)-1)]
+    darkCurrent = (anodeMean[before]+anodeMean[after])/2
+    # with a single neighbouring xray-off plateau, the dark current is its mean and keeps its error:
+    errDarkCurrent = np.where(before==after, errAnodeMean[before], np.sqrt(errAnodeMean[before]**2+errAnodeMean[after]**2)/2)
+
+    accumulator = setpoints.SetpointAccumulator(resolution)
+    accumulator.Update(
+        xrayMean[onIndices], errXrayMean[onIndices],
+        anodeMean[onIndices]-darkCurrent, np.sqrt(errAnodeMean[onIndices]**2+errDarkCurrent**2)
+    )
+    return accumulator.Result()
+
+def ReadCurrentLog(inputFile, timeColumn, xrayColumn, anodeColumn, sheet=0):
+    # raw log as csv or excel workbook, returns time, xray and anode current arrays
+    if inputFile.endswith('.csv'): df = pd.read_csv(inputFile, usecols=[timeColumn, xrayColumn, anodeColumn])
+    else: df = excelcache.readExcel(inputFile, sheet_name=sheet, usecols=[timeColumn, xrayColumn, anodeColumn])
+    time = df[timeColumn]
+    if not np.issubdtype(time.dtype, np.number): time = (pd.to_datetime(time)-pd.Timestamp(0)).dt.total_seconds()
+    return np.asarray(time, dtype='float64'), np.asarray(df[xrayColumn], dtype='float64'), np.asarray(df[anodeColumn], dtype='float64')
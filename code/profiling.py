@@ -0,0 +1,56 @@
+import os
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+# lightweight stage timing: disabled by default, in which case stages cost a flag check.
+# Events are kept as chrome trace complete events (times in us), viewable in chrome://tracing or perfetto
+
+enabled = False
+events = list()
+openStages = list() # args of the stages currently running, innermost last
+
+@contextmanager
+def Stage(stageName, **args):
+    if not enabled:
+        yield
+        return
+    openStages.append(args)
+    start = time.perf_counter()
+    try: yield
+    finally:
+        end = time.perf_counter()
+        openStages.pop()
+        events.append({
+            'name': stageName, 'ph': 'X', 'ts': start*1e6, 'dur': (end-start)*1e6,
+            'pid': os.getpid(), 'tid': 0, 'args': args
+        })
+
+def Annotate(**args):
+    # attach information, e.g. fit status, to the innermost running stage
+    if enabled and openStages: openStages[-1].update(args)
+
+def Timed(function):
+    # decorator recording each call of a function as a stage, labelled with the name of its object if any
+    @functools.wraps(function)
+    def timedFunction(*args, **kwargs):
+        if not enabled: return function(*args, **kwargs)
+        label = getattr(args[0], 'name', None) if args else None
+        with Stage(function.__qualname__, **({'name': label} if isinstance(label, str) else {})):
+            return function(*args, **kwargs)
+    return timedFunction
+
+def Summary():
+    print(f'{"stage":>40s} {"calls":>6s} {"total (s)":>10s} {"mean (s)":>10s}')
+    stages = dict()
+    for event in events:
+        calls, total = stages.get(event['name'], (0, 0))
+        stages[event['name']] = calls+1, total+event['dur']/1e6
+    for name,(calls,total) in sorted(stages.items(), key=lambda stage: -stage[1][1]):
+        print(f'{name:>40s} {calls:6d} {total:10.3f} {total/calls:10.3f}')
+    for event in events:
+        if 'status' in event['args']: print(f'{event["name"]:>40s}', event['args'])
+
+def SaveTrace(path):
+    with open(path, 'w') as f: json.dump({ 'traceEvents': events }, f)
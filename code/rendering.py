@@ -0,0 +1,54 @@
+import time
+
+from lazyroot import rt
+import profiling
+
+class RenderQueue:
+    # collects plots and renders them in one pass through a single reused canvas,
+    # writing all ROOT objects to one file with a directory per tree
+
+    def __init__(self, rootPath, formats=['eps']):
+        self.rootPath = rootPath
+        self.formats = formats
+        self.entries = list()
+        self.timing = dict()
+
+    def Add(self, imagePath, directory, drawable, drawOption, rootObjects=None, logx=False):
+        # imagePath without extension, one image is saved per format;
+        # rootObjects are written to directory in the ROOT file, by default the drawn object
+        if rootObjects is None: rootObjects = [drawable]
+        self.entries.append((imagePath, directory, drawable, drawOption, rootObjects, logx))
+
+    def Time(self, stage, start):
+        self.timing[stage] = self.timing.get(stage, 0)+time.perf_counter()-start
+
+    @profiling.Timed
+    def Render(self):
+        start = time.perf_counter()
+        canvas = rt.TCanvas('RenderCanvas', '', 600, 600)
+        rootFile = rt.TFile(self.rootPath, 'UPDATE') # keep directories of trees not rendered in this pass
+        self.Time('open', start)
+        for imagePath,directory,drawable,drawOption,rootObjects,logx in self.entries:
+            start = time.perf_counter()
+            canvas.Clear()
+            canvas.SetLogx(logx)
+            drawable.Draw(drawOption)
+            self.Time('draw', start)
+            for imageFormat in self.formats:
+                start = time.perf_counter()
+                canvas.SaveAs(f'{imagePath}.{imageFormat}')
+                self.Time(imageFormat, start)
+
+            start = time.perf_counter()
+            if directory: rootFile.mkdir(directory, '', True).cd()
+            else: rootFile.cd()
+            for rootObject in rootObjects: rootObject.Write('', rt.TObject.kOverwrite)
+            self.Time('root', start)
+        start = time.perf_counter()
+        rootFile.Close()
+        self.Time('close', start)
+        self.entries = list()
+
+    def Report(self):
+        print('Rendering time per stage:')
+        for stage,seconds in self.timing.items(): print(f'{stage:>8s}: {seconds:.3f} s')
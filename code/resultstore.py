@@ -0,0 +1,98 @@
+import os
+import json
+import time
+
+import numpy as np
+
+try: import pyarrow as pa
+except ImportError: pa = None
+
+# columnar store of all point-level results: one table per run, one row per (tree, divider current, xray current).
+# Tables are arrow ipc files when pyarrow is installed, otherwise directories of npy columns; both are
+# memory-mapped when read, and runs are appended as new tables so that a query is a single scan over the store
+
+keyColumns = ['tree', 'dividerCurrent', 'linearizationMethod', 'collimatorRadius']
+pointColumns = [
+    'xray', 'errXray', 'anode', 'errAnode', 'linearized', 'errLinearized',
+    'gain', 'errGain', 'rate', 'errRate', 'flux', 'errFlux', 'effectiveGain', 'errEffectiveGain'
+]
+
+def Table(meas, dividerCurrents):
+    # columns for all data-takings of a measurement evaluated at one or more divider currents
+    columns = { column: list() for column in keyColumns+pointColumns }
+    for dataTaking in meas:
+        scan = dataTaking.Scan(dividerCurrents)
+        results = dataTaking.results
+        nDividerCurrents, npoints = scan['rate'].shape
+        keys = {
+            'tree': dataTaking.name, 'linearizationMethod': dataTaking.linearizationMethod,
+            'collimatorRadius': np.nan if dataTaking.collimatorRadius is None else dataTaking.collimatorRadius
+        }
+        for column,value in keys.items(): columns[column].append(np.full(nDividerCurrents*npoints, value))
+        columns['dividerCurrent'].append(np.repeat(scan['dividerCurrent'], npoints))
+        for column in ['gain', 'errGain']: columns[column].append(np.repeat(scan[column], npoints))
+        for column in ['xray', 'errXray', 'anode', 'errAnode', 'linearized', 'errLinearized']:
+            columns[column].append(np.tile(results[column], nDividerCurrents))
+        for column in ['rate', 'errRate', 'flux', 'errFlux', 'effectiveGain', 'errEffectiveGain']:
+            columns[column].append(scan[column].ravel())
+    return { column: np.concatenate(values) for column,values in columns.items() }
+
+class ResultStore:
+
+    def __init__(self, directory, useArrow=None):
+        self.directory = directory
+        self.useArrow = pa is not None if useArrow is None else useArrow
+        os.makedirs(directory, exist_ok=True)
+
+    def Runs(self):
+        # arrow files without their extension and npy directories as they are, so that run names may contain dots
+        runs = list()
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'): continue # temporary
+            if entry.is_dir(): runs.append(entry.name)
+            elif entry.name.endswith('.arrow'): runs.append(entry.name[:-len('.arrow')])
+        return sorted(runs)
+
+    def Write(self, table, run=None):
+        # write a new table, named by default after the current time; returns the run name
+        runs = self.Runs()
+        if run is None:
+            timestamp = run = time.strftime('%Y%m%d-%H%M%S')
+            for suffix in range(1, len(runs)+1):
+                if run not in runs: break
+                run = f'{timestamp}-{suffix}'
+        elif run in runs: raise FileExistsError(f'Run {run} already in {self.directory}')
+        temporaryPath = f'{self.directory}/.{run}.{os.getpid()}.tmp'
+        if self.useArrow:
+            arrowTable = pa.table({ column: pa.array(values) for column,values in table.items() })
+            with pa.OSFile(temporaryPath, 'wb') as sink, pa.ipc.new_file(sink, arrowTable.schema) as writer:
+                writer.write_table(arrowTable)
+            os.replace(temporaryPath, f'{self.directory}/{run}.arrow')
+        else:
+            os.makedirs(temporaryPath)
+            for column,values in table.items():
+                values = np.asarray(values)
+                np.save(f'{temporaryPath}/{column}.npy', values.astype('U') if values.dtype==object else values)
+            with open(f'{temporaryPath}/columns.json', 'w') as f: json.dump(list(table), f)
+            os.replace(temporaryPath, f'{self.directory}/{run}')
+        return run
+
+    def Read(self, run):
+        # dict of column arrays, mapped from disk rather than loaded where possible
+        if os.path.isfile(f'{self.directory}/{run}.arrow'):
+            if pa is None: raise ImportError(f'pyarrow is needed to read run {run}')
+            arrowTable = pa.ipc.open_file(pa.memory_map(f'{self.directory}/{run}.arrow')).read_all()
+            return { column: arrowTable.column(column).to_numpy() for column in arrowTable.column_names }
+        with open(f'{self.directory}/{run}/columns.json') as f: columns = json.load(f)
+        return { column: np.load(f'{self.directory}/{run}/{column}.npy', mmap_mode='r') for column in columns }
+
+    def Scan(self, runs=None, **selection):
+        # rows of all (or the given) runs matching the selection on key columns, with a run column added
+        tables = list()
+        for run in runs or self.Runs():
+            table = self.Read(run)
+            mask = np.ones(len(table['tree']), dtype=bool)
+            for column,value in selection.items(): mask &= table[column]==value
+            tables.append({ 'run': np.full(mask.sum(), run), **{ column: values[mask] for column,values in table.items() } })
+        if not tables: return dict()
+        return { column: np.concatenate([ table[column] for table in tables ]) for column in tables[0] }
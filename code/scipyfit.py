@@ -0,0 +1,321 @@
+import numpy as np
+
+import profiling
+
+# numpy implementation of the anode current linearization fits, free of ROOT and TF1 formulas.
+# Each model returns the function value, its derivative in x and its jacobian in the parameters.
+# scipy is only imported by the fits themselves, the seeding helpers also used by the ROOT backend only need numpy.
+
+def linear(x, p):
+    A, B = p
+    jacobian = np.stack([x, np.ones_like(x)], axis=-1)
+    return A*x+B, np.full_like(x, A), jacobian
+
+def saturation(x, p): # (A+Bx)/(1+tau(A+Bx))
+    A, B, t = p
+    u = A*x+B
+    d = 1+u*t
+    jacobian = np.stack([x/d**2, 1/d**2, -u**2/d**2], axis=-1)
+    return u/d, A/d**2, jacobian
+
+def shiftedSaturation(x, p):
+    A, B, t, x3, c = p
+    u = A*(x-x3)+B
+    d = 1+u*t
+    jacobian = np.stack([(x-x3)/d**2, 1/d**2, -u**2/d**2, -A/d**2, np.ones_like(x)], axis=-1)
+    return u/d+c, A/d**2, jacobian
+
+def piecewiseSaturation(x, p):
+    A1, B1, t1, x0, A2, B2, t2 = p
+    below, above = x<x0, x>x0 # as in the TF1 formula, zero at the breakpoint
+    value1, derivative1, jacobian1 = saturation(x, (A1, B1, t1))
+    # above the breakpoint, (a+u)/(1+a*t1+u*t2) with a the first line at x0:
+    a, u = A1*x0+B1, A2*(x-x0)+B2
+    n, d = a+u, 1+a*t1+u*t2
+    dn = np.stack([np.full_like(x, x0), np.ones_like(x), np.zeros_like(x), np.full_like(x, A1-A2), x-x0, np.ones_like(x), np.zeros_like(x)], axis=-1)
+    dd = np.stack([np.full_like(x, x0*t1), np.full_like(x, t1), np.full_like(x, a), np.full_like(x, A1*t1-A2*t2), (x-x0)*t2, np.full_like(x, t2), u], axis=-1)
+    value2, derivative2 = n/d, A2*(d-n*t2)/d**2
+    jacobian2 = (dn*d[:,None]-n[:,None]*dd)/d[:,None]**2
+    jacobian = np.zeros(x.shape+(7,))
+    jacobian[:,:3] = jacobian1*below[:,None]
+    jacobian += jacobian2*above[:,None]
+    return value1*below+value2*above, derivative1*below+derivative2*above, jacobian
+
+# power of the current scale carried by each parameter; currents (~1e-8 A) are normalized
+# to order one before fitting, otherwise slopes and time constants differ by ~20 orders of magnitude:
+currentPowers = {
+    linear: [1, 1],
+    saturation: [1, 1, -1],
+    shiftedSaturation: [1, 1, -1, 0, 1],
+    piecewiseSaturation: [1, 1, -1, 0, 1, 1, -1]
+}
+
+def fit(model, x, errX, y, errY, parameters, xmin, xmax, fixed=dict()):
+    # chi2 fit with effective variance errY**2+(f'(x)*errX)**2, as for TGraphErrors in ROOT;
+    # returns parameters, errors and covariance in the same format as the ROOT backend
+    from scipy.optimize import least_squares
+    inRange = (x>=xmin)&(x<=xmax)
+    x, errX, y, errY = x[inRange], errX[inRange], y[inRange], errY[inRange]
+    parameters = np.array(parameters, dtype='float64')
+    for ipar,value in fixed.items(): parameters[ipar] = value
+
+    currentScale = np.max(np.abs(y)) if len(y)>0 and np.max(np.abs(y))>0 else 1.
+    parameterScale = currentScale**np.array(currentPowers[model], dtype='float64')
+    y, errY, parameters = y/currentScale, errY/currentScale, parameters/parameterScale
+    free = np.array([ ipar not in fixed for ipar in range(len(parameters)) ])
+
+    def full(freeParameters):
+        p = parameters.copy()
+        p[free] = freeParameters
+        return p
+
+    def sigma(p):
+        value, derivative, jacobian = model(x, p)
+        return value, jacobian, np.sqrt(errY**2+(derivative*errX)**2)
+
+    def residuals(freeParameters):
+        value, jacobian, s = sigma(full(freeParameters))
+        return (y-value)/s
+
+    def jacobian(freeParameters):
+        value, jacobian, s = sigma(full(freeParameters))
+        return -jacobian[:,free]/s[:,None]
+
+    npar = len(parameters)
+    covariance = np.zeros((npar, npar))
+    if free.sum()>len(x): # not enough points in range, keep the starting values
+        return { 'parameters': parameters*parameterScale, 'errors': np.zeros(npar), 'covariance': covariance }
+    with profiling.Stage(f'Fit {model.__name__}', xmin=float(xmin), xmax=float(xmax)):
+        result = least_squares(residuals, parameters[free], jac=jacobian, x_scale='jac', method='lm')
+        profiling.Annotate(status=int(result.status), calls=int(result.nfev), chi2=2*float(result.cost), ndf=int(len(x)-free.sum()))
+    parameters = full(result.x)
+    covariance[np.ix_(free, free)] = np.linalg.pinv(result.jac.T @ result.jac)
+    parameters, covariance = parameters*parameterScale, covariance*np.outer(parameterScale, parameterScale)
+    return { 'parameters': parameters, 'errors': np.sqrt(np.diag(covariance)), 'covariance': covariance }
+
+def guessLinear(x, y, xmin, xmax):
+    # starting values for slope and intercept from a straight line through the points in range
+    inRange = (x>=xmin)&(x<=xmax)
+    if inRange.sum()<2: return 0., 0.
+    A, B = np.polyfit(x[inRange], y[inRange], 1)
+    return A, B
+
+defaultBreakpoint = 99.2 # uA, xray current at which the anode current slope changes in the reference campaign
+
+def parseBreakpoint(value):
+    # command line value of the breakpoint: a current in uA, or auto to detect it in each data-taking
+    return None if value=='auto' else float(value)
+
+def separationXrayCurrent(xray, breakpoint=defaultBreakpoint):
+    # last xray current of the lower part in two-part fits: setpoints up to the breakpoint, rounded up to the next uA
+    # for the reference breakpoint (99.2 -> 100) as in the original analysis, not for other (e.g. detected) breakpoints
+    if breakpoint==defaultBreakpoint: breakpoint = np.ceil(breakpoint)
+    return max(xray[xray<=breakpoint])
+
+def upperXrayCurrent(xray, separation):
+    # first xray current of the upper part in two-part fits: 1 uA above the separation, or the next setpoint if closer
+    above = xray[xray>separation]
+    return min(separation+1, above.min()) if len(above)>0 else separation+1
+
+def SeedSaturation(x, y, errY, offset=True):
+    # closed-form starting values (A, B, t) of the saturating model (A*x+B)/(1+t*(A*x+B)), which is
+    # y = (p+q*x)/(1+r*x) and so linear in p, q, r once multiplied by the denominator: y = p+q*x-r*x*y.
+    # Without offset (B=0), this is the straight line 1/y = 1/(A*x) + t in 1/x. Solved by weighted least squares,
+    # twice to weight the residuals of the linearized equation by the denominator; returns None with too few points
+    if len(x)<2+offset: return None
+    scale = np.max(np.abs(y)) or 1.
+    y, errY = y/scale, errY/scale
+    regressors = np.stack([np.ones_like(x), x, -x*y] if offset else [x, -x*y], axis=-1)
+    r = 0.
+    for iteration in range(2):
+        weights = 1/(errY*np.abs(1+r*x))
+        coefficients = np.linalg.lstsq(regressors*weights[:,None], y*weights, rcond=None)[0]
+        p, q, r = coefficients if offset else (0., *coefficients)
+    t = r/q if q!=0 else 0.
+    B = p/(1-t*p) if t*p!=1 else p
+    A = q*(1+t*B)
+    return A*scale, B*scale, t/scale
+
+def SeedPiecewiseSaturation(x, y, errY, x0, minPoints=3):
+    # starting values (A1, B1, t1, x0, A2, B2, t2) of the piecewise saturating model: closed-form seeds of the
+    # lower piece, then of the upper piece continuous at x0 (B2=0), for which with a = A1*x0+B1 and X = x-x0
+    # y*(1+a*t1)-a = A2*X - A2*t2*X*y is again linear in A2 and A2*t2
+    below, above = x<x0, x>x0
+    lower = SeedSaturation(x[below], y[below], errY[below]) if below.sum()>=minPoints else None
+    if lower is None: lower = (*guessLinear(x, y, 0, x0), 0.)
+    A1, B1, t1 = lower
+    if above.sum()<2: return [A1, B1, t1, x0, A1, 0., t1] # continue the lower piece
+    scale = np.max(np.abs(y[above])) or 1.
+    a, t1Scaled = (A1*x0+B1)/scale, t1*scale
+    X, yAbove, errYAbove = x[above]-x0, y[above]/scale, errY[above]/scale
+    regressors = np.stack([X, -X*yAbove], axis=-1)
+    A2, A2t2 = 0., 0.
+    for iteration in range(2):
+        weights = 1/(errYAbove*np.abs(1+a*t1Scaled+A2t2*X))
+        A2, A2t2 = np.linalg.lstsq(regressors*weights[:,None], (yAbove*(1+a*t1Scaled)-a)*weights, rcond=None)[0]
+    t2 = A2t2/A2 if A2!=0 else t1Scaled
+    return [A1, B1, t1, x0, A2*scale, 0., t2/scale]
+
+def DetectBreakpoint(x, y, errY, minPoints=3):
+    # xray current where the anode current changes slope: the split of the sorted points into two
+    # saturating pieces with the lowest total chi2 of their closed-form seeds, then the crossing
+    # of the two pieces between the points on either side of the split
+    def chi2(x, y, errY):
+        A, B, t = SeedSaturation(x, y, errY)
+        u = A*x+B
+        return np.sum(((y-u/(1+t*u))/errY)**2), (A, B, t)
+
+    order = np.argsort(x)
+    x, y, errY = x[order], y[order], errY[order]
+    best = None
+    for split in range(minPoints, len(x)-minPoints+1):
+        if x[split-1]==x[split]: continue
+        (chi2Lower, lower), (chi2Upper, upper) = chi2(x[:split], y[:split], errY[:split]), chi2(x[split:], y[split:], errY[split:])
+        if best is None or chi2Lower+chi2Upper<best[0]: best = (chi2Lower+chi2Upper, split, lower, upper)
+    if best is None: return defaultBreakpoint
+    chi2Total, split, lower, upper = best
+    gap = np.linspace(x[split-1], x[split], 101)[1:-1]
+    (A1, B1, t1), (A2, B2, t2) = lower, upper
+    u1, u2 = A1*gap+B1, A2*gap+B2
+    return gap[np.argmin(np.abs(u1/(1+t1*u1)-u2/(1+t2*u2)))]
+
+def FitExponential(x, y, errY=None):
+    # fit of exp(A+Bx), weighted if errY is given; without errors, as for a TGraph in ROOT, the
+    # covariance is scaled by chi2/ndf. Returns (A, B), covariance of A and B
+    from scipy.optimize import least_squares
+    B, A = np.polyfit(x, np.log(y), 1)
+    scale = np.max(y) # fit y/scale, i.e. shift A by log(scale)
+    weight = 1 if errY is None else scale/errY
+
+    def residuals(p):
+        return (y/scale-np.exp(p[0]+p[1]*x))*weight
+
+    def jacobian(p):
+        value = np.exp(p[0]+p[1]*x)*weight
+        return -np.stack([value, x*value], axis=-1)
+
+    result = least_squares(residuals, [A-np.log(scale), B], jac=jacobian, method='lm')
+    chi2, ndf = np.sum(result.fun**2), len(x)-2
+    covariance = np.linalg.pinv(result.jac.T @ result.jac)
+    if errY is None: covariance *= chi2/ndf
+    (A, B) = result.x
+    return (A+np.log(scale), B), covariance
+
+def FitAnodeCurrent(xray, errXray, anodeCurrent, errAnodeCurrent, linearizationMethod, breakpoint=defaultBreakpoint, seeding='closedForm'):
+    # same fits, ranges and fixed parameters as DataTaking.FitAnodeCurrent with ROOT; seeding is closedForm
+    # (SeedSaturation) or rangeFits, the former straight lines and saturation fits on 0-100 and 100-200 uA
+    data = (xray, errXray, anodeCurrent, errAnodeCurrent)
+    fitResults = dict()
+
+    def seed(xmin, xmax, offset=True):
+        inRange = (xray>=xmin)&(xray<=xmax)
+        if seeding=='closedForm':
+            seeds = SeedSaturation(xray[inRange], anodeCurrent[inRange], errAnodeCurrent[inRange], offset)
+            if seeds is not None: return seeds
+        A, B = guessLinear(xray, anodeCurrent, xmin, xmax)
+        return A, B if offset else 0, 0
+
+    if linearizationMethod=='saturation':
+        A, B, t = seed(0, 200, offset=False)
+        fitResults['p'] = fit(saturation, *data, [A, 0, t], 0, 200, fixed={1: 0})
+    elif linearizationMethod=='firstpoints':
+        fitResults['p'] = fit(linear, *data, guessLinear(xray, anodeCurrent, 0, 30), 0, 30)
+    elif linearizationMethod=='saturation2part':
+        separation = separationXrayCurrent(xray, breakpoint)
+        A1, B1, t1 = seed(0.1, separation, offset=False)
+        fitResults['p1'] = fit(saturation, *data, [A1, 0, t1], 0.1, separation, fixed={1: 0})
+        offset2 = saturation(np.array([breakpoint]), fitResults['p1']['parameters'])[0][0]
+        upper = upperXrayCurrent(xray, separation)
+        inRange = (xray>=upper)&(xray<=200)
+        seeds = SeedSaturation(xray[inRange]-breakpoint, anodeCurrent[inRange]-offset2, errAnodeCurrent[inRange], offset=False) if seeding=='closedForm' else None
+        if seeds is None: (A2, B2), t2 = guessLinear(xray, anodeCurrent, upper, 200), 0
+        else: A2, B2, t2 = seeds
+        fitResults['p2'] = fit(shiftedSaturation, *data, [A2, 0, t2, 0, 0], upper, 200, fixed={3: breakpoint, 4: offset2})
+    elif linearizationMethod=='piecewiseSaturation':
+        if seeding=='closedForm': parameters = SeedPiecewiseSaturation(xray, anodeCurrent, errAnodeCurrent, breakpoint)
+        else:
+            # get initial guess for parameters A and B from fit on restricted range:
+            seeds = list()
+            for xmin,xmax in [(0, 100), (100, 200)]:
+                A, B = guessLinear(xray, anodeCurrent, xmin, xmax)
+                seeds.append(fit(saturation, *data, [A, B, 0], xmin, xmax)['parameters'])
+            (A1, B1, t1), (A2, B2, t2) = seeds
+            parameters = [A1, B1, t1, 99, A2, B2, t2]
+        fitResults['p1'] = fit(piecewiseSaturation, *data, parameters, 0, 200, fixed={3: breakpoint})
+    else: raise ValueError('Unrecognized current linearization method')
+    return fitResults
+
+def FitJoint(datasets, parameters, shared, fixed=dict(), xmin=0, xmax=200, model=piecewiseSaturation):
+    # simultaneous fit of several data sets (x, errX, y, errY) with one model: parameters in shared take one value
+    # for all data sets, fixed ones are constant and the others are fitted per data set. Residuals of all points
+    # are computed at once over the concatenated data; returns one { parameters, errors, covariance } per data set
+    from scipy.optimize import least_squares
+    parameters = np.array(parameters, dtype='float64') # starting values, one row per data set
+    ndatasets, npar = parameters.shape
+    inRange = [ (dataset[0]>=xmin)&(dataset[0]<=xmax) for dataset in datasets ]
+    x, errX, y, errY = [ np.concatenate([ dataset[i][mask] for dataset,mask in zip(datasets, inRange) ]) for i in range(4) ]
+    datasetIndex = np.concatenate([ np.full(mask.sum(), idataset) for idataset,mask in enumerate(inRange) ])
+
+    currentScale = np.max(np.abs(y)) if len(y)>0 and np.max(np.abs(y))>0 else 1.
+    parameterScale = currentScale**np.array(currentPowers[model], dtype='float64')
+    y, errY, parameters = y/currentScale, errY/currentScale, parameters/parameterScale
+
+    # index of each (data set, parameter) in the vector of free parameters followed by the fixed values:
+    index, values = np.zeros((ndatasets, npar), dtype=int), list()
+    for ipar in range(npar):
+        if ipar in shared or ipar in fixed:
+            index[:,ipar] = len(values)
+            values.append(parameters[0,ipar])
+        else:
+            index[:,ipar] = len(values)+np.arange(ndatasets)
+            values += list(parameters[:,ipar])
+    isFree = np.ones(len(values), dtype=bool)
+    for ipar,value in fixed.items():
+        values[index[0,ipar]], isFree[index[0,ipar]] = value/parameterScale[ipar], False
+    values = np.array(values)
+    nfree = isFree.sum()
+    order = np.concatenate([ np.flatnonzero(isFree), np.flatnonzero(~isFree) ]) # free values first
+    index = np.argsort(order)[index]
+    values = values[order]
+
+    def evaluate(freeValues):
+        full = np.concatenate([ freeValues, values[nfree:] ])
+        value, derivative, jacobian = model(x, full[index][datasetIndex].T)
+        return value, jacobian, np.sqrt(errY**2+(derivative*errX)**2)
+
+    def residuals(freeValues):
+        value, jacobian, s = evaluate(freeValues)
+        return (y-value)/s
+
+    def jacobian(freeValues):
+        value, jacobian, s = evaluate(freeValues)
+        fullJacobian = np.zeros((len(x), len(values)))
+        fullJacobian[np.arange(len(x))[:,None], index[datasetIndex]] = -jacobian/s[:,None]
+        return fullJacobian[:,:nfree]
+
+    with profiling.Stage(f'Joint fit {model.__name__}', datasets=ndatasets, free=int(nfree)):
+        result = least_squares(residuals, values[:nfree], jac=jacobian, x_scale='jac', method='lm')
+        profiling.Annotate(status=int(result.status), calls=int(result.nfev), chi2=2*float(result.cost), ndf=int(len(x)-nfree))
+    full = np.concatenate([ result.x, values[nfree:] ])
+    covariance = np.zeros((len(values), len(values)))
+    covariance[:nfree,:nfree] = np.linalg.pinv(result.jac.T @ result.jac)
+    fitResults = list()
+    for idataset in range(ndatasets):
+        datasetCovariance = covariance[np.ix_(index[idataset], index[idataset])]*np.outer(parameterScale, parameterScale)
+        fitResults.append({
+            'parameters': full[index[idataset]]*parameterScale,
+            'errors': np.sqrt(np.diag(datasetCovariance)), 'covariance': datasetCovariance
+        })
+    return fitResults
+
+def FitJointPiecewiseSaturation(datasets, shared=[2, 6], fixed={3: defaultBreakpoint}):
+    # joint piecewise saturation fit over data-takings at different distances: by default the time constants
+    # t1, t2 are shared and the breakpoint x0 fixed for all, only slopes and offsets are per data-taking.
+    # Starting values are the closed-form seeds of each data-taking, with the median of shared parameters
+    x0 = fixed.get(3, defaultBreakpoint)
+    parameters = np.array([
+        SeedPiecewiseSaturation(xray, anodeCurrent, errAnodeCurrent, x0)
+        for xray, errXray, anodeCurrent, errAnodeCurrent in datasets
+    ])
+    parameters[:,shared] = np.median(parameters[:,shared], axis=0)
+    return FitJoint(datasets, parameters, shared, fixed, 0, 200, piecewiseSaturation)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+# column names as in root and excel files:
+columnNames = ['XrayCurrent', 'ERRXrayCurrent', 'Ianode', 'ERRIanode']
+
+def branchName(column):
+    # tree branch name of an excel column
+    return column.replace(' ', '').replace('-', '')
+
+defaultResolution = 0.1 # uA, as for the plateaus of raw current logs, well above the noise of the xray current readback
+
+class SetpointAccumulator:
+    # running per-setpoint sums of current samples, fed chunk by chunk so that memory
+    # only grows with the number of xray current setpoints, not with the log length
+
+    def __init__(self, resolution=defaultResolution):
+        self.resolution = resolution # group xray currents within this many uA, None for exact values
+        self.setpoints = np.zeros(0) # sorted
+        self.sums = np.zeros((0, 7)) # per setpoint: n, sum x, sum x2, sum errx2, sum y, sum y2, sum erry2
+
+    def Update(self, xray, errXray, anode, errAnode):
+        # merge the sums of the chunk with those of the previous chunks in one pass over both
+        if len(xray)==0: return
+        if self.resolution: keys = np.round(xray/self.resolution)*self.resolution
+        else: keys = xray
+        self.setpoints, inverse = np.unique(np.concatenate([self.setpoints, keys]), return_inverse=True)
+        columns = [np.ones_like(xray), xray, xray**2, errXray**2, anode, anode**2, errAnode**2]
+        weights = np.concatenate([self.sums, np.stack(columns, axis=-1)])
+        self.sums = np.stack([ np.bincount(inverse, weights=column, minlength=len(self.setpoints)) for column in weights.T ], axis=-1)
+
+    def Result(self):
+        # mean and error per setpoint, sorted by xray current; the error combines the spread of the
+        # samples (standard error of the mean) with the per-sample errors, so a single sample keeps its own error
+        sums = self.sums
+        n = sums[:,0]
+        result = dict()
+        for column,errColumn,(isum,isum2,isumErr2) in zip(columnNames[::2], columnNames[1::2], [(1, 2, 3), (4, 5, 6)]):
+            mean = sums[:,isum]/n
+            variance = np.where(n>1, np.clip(sums[:,isum2]/n-mean**2, 0, None), 0)
+            result[column] = mean
+            result[errColumn] = np.sqrt(variance/n + sums[:,isumErr2]/n**2)
+        return pd.DataFrame(result, columns=columnNames)
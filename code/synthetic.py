@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+import scipyfit
+
+# synthetic rate capability data for benchmarks and validation: anode currents follow the piecewise
+# saturating model used for the linearization, with slopes falling with the xray-to-chamber distance
+
+sheetColumns = ['XrayCurrent', 'ERR XrayCurrent', 'Ianode', 'ERR Ianode'] # as in the XRay-off-substracted sheet
+
+def TrueParameters(distance):
+    # piecewise saturation parameters A1, B1, t1, x0, A2, B2, t2 at a distance in cm
+    slope = 3e-10*(15/distance)**2
+    return np.array([slope, 0, 2e6, 99.2, 0.5*slope, 0, 1e6])
+
+def SaturatingCurve(npoints, distance, relativeError=0.01, generator=None, breakpoint=99.2, xray=None):
+    # one data-taking: npoints xray current setpoints between 1 and 200 uA, or the given ones (none at the breakpoint)
+    generator = generator or np.random.default_rng()
+    xray = np.linspace(1, 200, npoints) if xray is None else np.array(xray, dtype='float64')
+    npoints = len(xray)
+    xray[np.isclose(xray, breakpoint)] -= 0.5
+    parameters = TrueParameters(distance)
+    parameters[3] = breakpoint
+    anode = scipyfit.piecewiseSaturation(xray, parameters)[0]
+    errXray, errAnode = relativeError*xray, relativeError*anode
+    anode = anode + errAnode*generator.standard_normal(npoints)
+    return pd.DataFrame(dict(zip(sheetColumns, [xray, errXray, -anode, errAnode])))
+
+def RawCurrentLog(nsamples, setpoints, darkCurrent=2e-11, noise=1e-12, distance=15, generator=None):
+    # raw picoammeter log alternating xray-off and xray-on plateaus over the setpoints,
+    # returns time (s), xray current (uA) and anode current (A, negative)
+    generator = generator or np.random.default_rng()
+    sequence = np.zeros(2*len(setpoints)+1)
+    sequence[1::2] = setpoints
+    plateau = np.arange(nsamples)*len(sequence)//nsamples
+    xray = sequence[plateau]
+    anode = scipyfit.piecewiseSaturation(xray, TrueParameters(distance))[0]*(xray>0)
+    time = np.arange(nsamples, dtype='float64')
+    drift = 1e-16*time
+    anode = -(anode+darkCurrent+drift+noise*generator.standard_normal(nsamples))
+    xray = xray+0.01*generator.standard_normal(nsamples)*(xray>0)
+    return time, xray, anode
@@ -0,0 +1,80 @@
+import numpy as np
+
+import measurement
+import workers
+
+# toy Monte Carlo propagation of the uncertainties on rate, flux and effective gain: the linearization
+# fit parameters and the gain curve parameters are drawn from their covariance, the number of primaries
+# and the measured currents from their errors, and all toys are evaluated as one array operation
+
+quantities = ['linearized', 'rate', 'flux', 'effectiveGain']
+
+def ToyInputs(dataTaking):
+    # plain arrays needed to generate toys for a data-taking, safe to send to worker processes
+    xray, errXray = dataTaking.xrayCurrent
+    anode, errAnode = dataTaking.anodeCurrent
+    gainCurve = dataTaking.gainCurve
+    return {
+        'xray': xray, 'errXray': errXray, 'anode': anode, 'errAnode': errAnode,
+        'linearizationMethod': dataTaking.linearizationMethod, 'fitResults': dataTaking.fitResults,
+        'gainParameters': np.array([gainCurve.A, gainCurve.B]), 'gainCovariance': gainCurve.covariance,
+        'dividerCurrent': dataTaking.chamberDividerCurrent, 'spotArea': dataTaking.spotArea
+    }
+
+def sampleParameters(generator, parameters, covariance, ntoys):
+    # correlated gaussian draws; sampled through the correlation matrix since parameters such as
+    # slopes (~1e-10) and time constants (~1e6) would make the raw covariance numerically singular
+    sigma = np.sqrt(np.diag(covariance))
+    free = sigma>0 # fixed parameters have no error
+    correlation = covariance[np.ix_(free, free)]/np.outer(sigma[free], sigma[free])
+    toys = np.tile(parameters, (ntoys, 1))
+    toys[:,free] += sigma[free]*generator.multivariate_normal(np.zeros(free.sum()), correlation, ntoys, method='eigh')
+    return toys
+
+def RunToys(inputs, ntoys, seed=None):
+    # returns sum and sum of squares over the toys of each quantity, per xray current point
+    generator = np.random.default_rng(seed)
+    xray, anode = inputs['xray'], inputs['anode']
+    xrayToys = xray+inputs['errXray']*generator.standard_normal((ntoys, len(xray)))
+    anodeToys = anode+inputs['errAnode']*generator.standard_normal((ntoys, len(anode)))
+    parameterToys = {
+        fitName: sampleParameters(generator, fitResult['parameters'], fitResult['covariance'], ntoys)
+        for fitName,fitResult in inputs['fitResults'].items()
+    }
+    gainToys = sampleParameters(generator, inputs['gainParameters'], inputs['gainCovariance'], ntoys)
+    primariesToys = measurement.primaries+measurement.errPrimaries*generator.standard_normal((ntoys, 1))
+
+    toys = dict()
+    toys['linearized'] = measurement.linearizeCurrent(inputs['linearizationMethod'], parameterToys, xrayToys, xray)
+    gain = np.exp(gainToys[:,0,None]+inputs['dividerCurrent']*gainToys[:,1,None])
+    toys['rate'] = toys['linearized']/(measurement.qe*primariesToys*gain)
+    toys['flux'] = toys['rate']/inputs['spotArea']
+    toys['effectiveGain'] = anodeToys/(measurement.qe*primariesToys*toys['rate'])
+    return { quantity: (toys[quantity].sum(axis=0), (toys[quantity]**2).sum(axis=0), ntoys) for quantity in quantities }
+
+def RunToysAll(inputsList, ntoys, seed=None):
+    return [ RunToys(inputs, ntoys, seed) for inputs,seed in zip(inputsList, seed.spawn(len(inputsList))) ]
+
+def Summarize(sums):
+    # mean and standard deviation per quantity from the (sum, sum of squares, ntoys) of one or more shards
+    summary = dict()
+    for quantity in quantities:
+        total, totalSquares, ntoys = [ sum(shard[quantity][i] for shard in sums) for i in range(3) ]
+        mean = total/ntoys
+        summary[quantity] = mean, np.sqrt(np.clip(totalSquares/ntoys-mean**2, 0, None))
+    return summary
+
+def ToyMC(meas, ntoys, seed=None, jobs=1):
+    # returns dict data-taking name -> quantity -> (toy mean, toy standard deviation);
+    # with jobs>1 the toys are split in shards run by separate processes
+    inputsList = [ ToyInputs(dataTaking) for dataTaking in meas ]
+    seeds = np.random.SeedSequence(seed).spawn(jobs)
+    if jobs>1:
+        shardSizes = [ ntoys//jobs + (ishard<ntoys%jobs) for ishard in range(jobs) ]
+        with workers.spawnPool(jobs) as executor:
+            shards = list(executor.map(RunToysAll, [inputsList]*jobs, shardSizes, seeds))
+    else: shards = [RunToysAll(inputsList, ntoys, seeds[0])]
+    return {
+        dataTaking.name: Summarize([ shard[idataTaking] for shard in shards ])
+        for idataTaking,dataTaking in enumerate(meas)
+    }
@@ -0,0 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+def spawnPool(jobs, **kwargs):
+    # pool of fresh (spawned) worker processes: ROOT is neither thread- nor fork-safe, so parallel work
+    # runs in processes started from scratch; kwargs are passed on, e.g. initializer and initargs
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'), **kwargs)